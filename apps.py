@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# The apps install.py can install.
+#
+# Each App names the module and class of its installer, the keyword
+# arguments it's created with, the apps which must be installed before
+# it, whether it's part of "all", the binaries "install.py verify"
+# probes, its entry in the install manifest and the files its build
+# depends on. An installer module is only imported when one of its
+# installers is created or an expected version is needed, so reading
+# the table imports nothing. Adding an app is adding an entry.
+#
+# After an app installs, install.py stores its fingerprint, a hash of
+# its installer's source, its files and the options which affect the
+# build, in its manifest entry. A later run finds it already installed
+# from the manifest alone, without importing the installer, as long
+# as the fingerprint is the same and its files are unchanged.
+
+import collections
+import hashlib
+import importlib
+import json
+import os
+
+App = collections.namedtuple('App', ['name', 'module', 'cls', 'kwargs', 'deps', 'inAll', 'probes',
+        'entry', 'sources'])
+
+# A binary installed in dir, relative to the install root, which prints
+# its version when run with versionArg. verAttr is the attribute of the
+# installer module with the version expected.
+Probe = collections.namedtuple('Probe', ['binary', 'dir', 'versionArg', 'verAttr'])
+
+# The options which change what an installer builds
+FINGERPRINT_OPTIONS = ['ver', 'gitver', 'target', 'crossDir', 'installPrefixDir']
+
+def ctNgProbes(target, gccVerAttr):
+    dirPath = 'x-tools/{}/bin'.format(target)
+    return [Probe(target + '-ld', dirPath, '--version', 'BINU_VER'),
+            Probe(target + '-gcc', dirPath, '--version', gccVerAttr)]
+
+APPS = [
+    App('ninja', 'ninja_install', 'Installer', {}, [], True,
+            [Probe('ninja', 'bin', '--version', 'DEFAULT_VER')], 'ninja', []),
+    App('meson', 'meson_install', 'Installer', {}, [], True,
+            [Probe('meson', 'bin', '-v', 'DEFAULT_VER')], 'meson', []),
+    App('ct-ng', 'crosstool_ng_install', 'Installer', {}, [], True,
+            [Probe('ct-ng', 'bin', 'version', 'DEFAULT_VER')], 'ct-ng', []),
+    App('gcc-x86_64', 'ct_ng_runner', 'Builder', {'defaultTarget': 'x86_64-unknown-elf'},
+            ['ct-ng'], True, ctNgProbes('x86_64-unknown-elf', 'GCC_INTR_ATTR_VER'),
+            '{target}-gcc', ['config.{target}']),
+    App('gcc-i386', 'ct_ng_runner', 'Builder', {'defaultTarget': 'i386-unknown-elf'},
+            ['ct-ng'], True, ctNgProbes('i386-unknown-elf', 'GCC_INTR_ATTR_VER'),
+            '{target}-gcc', ['config.{target}']),
+    App('gcc-arm', 'ct_ng_runner', 'Builder', {'defaultTarget': 'arm-unknown-eabi'},
+            ['ct-ng'], True, ctNgProbes('arm-unknown-eabi', 'GCC_VER'),
+            '{target}-gcc', ['config.{target}']),
+    App('qemu-system-arm', 'qemu_install', 'Installer', {}, [], True,
+            [Probe('qemu-system-arm', 'bin', '--version', 'DEFAULT_VER')], 'qemu-system-arm', []),
+    App('binutils-arm-eabi', 'binutils_install', 'Installer', {'defaultTarget': 'arm-eabi'},
+            [], False,
+            [Probe('arm-eabi-ld', 'cross/bin', '--version', 'DEFAULT_VER'),
+             Probe('arm-eabi-gdb', 'cross/bin', '--version', 'GDB_VER')],
+            '{target}-binutils-gdb', []),
+    App('binutils-i586-elf', 'binutils_install', 'Installer', {'defaultTarget': 'i586-elf'},
+            [], False,
+            [Probe('i586-elf-ld', 'cross/bin', '--version', 'DEFAULT_VER'),
+             Probe('i586-elf-gdb', 'cross/bin', '--version', 'GDB_VER')],
+            '{target}-binutils-gdb', []),
+    App('gcc-arm-eabi', 'gcc_install', 'Installer', {'defaultTarget': 'arm-eabi'},
+            ['binutils-arm-eabi'], False,
+            [Probe('arm-eabi-gcc', 'cross/bin', '--version', 'DEFAULT_VER')],
+            '{target}-gcc', []),
+    App('gcc-i586-elf', 'gcc_install', 'Installer', {'defaultTarget': 'i586-elf'},
+            ['binutils-i586-elf'], False,
+            [Probe('i586-elf-gcc', 'cross/bin', '--version', 'DEFAULT_VER')],
+            '{target}-gcc', []),
+]
+
+_apps = dict((app.name, app) for app in APPS)
+
+# The apps installed by "all" and those which must be named
+ALL = [app.name for app in APPS if app.inAll]
+OTHER = [app.name for app in APPS if not app.inAll]
+
+def get(name):
+    '''The App called name, raises KeyError if there's none'''
+    return _apps[name]
+
+def module(name):
+    '''The installer module of the app called name, imported on first use'''
+    return importlib.import_module(get(name).module)
+
+def create(name, values=None):
+    '''A new Installer or Builder for the app called name.
+
+    Its InstallArgs are parsed from sys.argv, or if values, a dict of
+    option name to value, is supplied they're the defaults updated
+    with values, see parseinstallargs.InstallArgs.
+    '''
+    app = get(name)
+    return getattr(module(name), app.cls)(values=values, **app.kwargs)
+
+def expectedVer(name, probe):
+    '''The version probe of the app called name should report'''
+    return getattr(module(name), probe.verAttr)
+
+def target(name, args):
+    '''The target the app called name is built for with InstallArgs args'''
+    return args.target or get(name).kwargs.get('defaultTarget', '')
+
+def entryName(name, args):
+    '''The name of the manifest entry of the app called name'''
+    return get(name).entry.format(target=target(name, args))
+
+def fingerprint(name, args):
+    '''A hash of everything which determines what the app called name
+    builds with InstallArgs args, computed without importing its installer'''
+    app = get(name)
+    thisDir = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    options = dict((option, getattr(args, option)) for option in FINGERPRINT_OPTIONS)
+    options['unknownArgs'] = args.unknownArgs
+    h.update(json.dumps([name, app.kwargs, options], sort_keys=True).encode('utf-8'))
+    # Its installer and those of its dependencies, which it may use
+    paths = ['{}.py'.format(get(n).module) for n in [name] + app.deps]
+    paths += [source.format(target=target(name, args)) for source in app.sources]
+    for path in paths:
+        with open(os.path.join(thisDir, path), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def isInstalled(name, args, installed):
+    '''True if installed, a manifest.Manifest, has the app called name
+    installed with the same fingerprint and its files unchanged. False
+    only means the installer has to be asked.'''
+    entry = installed.lookup(entryName(name, args))
+    return (entry is not None and entry.get('fingerprint') == fingerprint(name, args)
+            and installed.isInstalled(entryName(name, args), entry['ver']))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+import utils
+import timing
+
+import hashlib
+import json
+import os
+import platform
+import tempfile
+
+def fromArgs(args):
+    '''The ArtifactCache for InstallArgs args or None if disabled'''
+    if args.noArtifactCache:
+        return None
+    return ArtifactCache(os.path.join(args.cacheDir, 'artifacts'))
+
+def hostTriple():
+    '''Describes the build host, artifacts are only reused on the same kind of host'''
+    return '{}-{}-{}'.format(platform.machine(), platform.system().lower(),
+            ''.join(platform.libc_ver()))
+
+def key(**fields):
+    '''The cache key of a build described by fields and the host'''
+    fields['host'] = hostTriple()
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ArtifactCache:
+    '''Cache of installed build results.
+
+    Each entry is a compressed tar of the files an install added to its
+    prefix, keyed by a hash of everything which affects the build, see
+    key(). A hit is restored by unpacking it in to the prefix.
+    '''
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def entryPath(self, key):
+        return os.path.join(self.cacheDir, '{}.tar.gz'.format(key))
+
+    def contains(self, key):
+        return os.path.exists(self.entryPath(key))
+
+    def restore(self, key, prefix):
+        '''Unpack the entry for key in to prefix, returns the paths of the
+        files restored relative to prefix or None on a miss'''
+        path = self.entryPath(key)
+        if not os.path.exists(path):
+            print('artifactcache: miss', key)
+            return None
+        print('artifactcache: restoring {} to {}'.format(path, prefix))
+        os.makedirs(prefix, exist_ok=True)
+        # Restored files get the current time as they're new to this prefix
+        with timing.span('restore', key=key):
+            names = utils.output(['tar', '-xmvf', path, '--quoting-style=literal', '-C', prefix])
+        # Entries are saved without directories
+        return [name for name in names.splitlines() if name and not name.endswith('/')]
+
+    def save(self, key, prefix, files=None):
+        '''Pack files, paths relative to prefix or all of prefix if None,
+        as the entry for key'''
+        if files is None:
+            files = utils.files_changed_since(prefix)
+        print('artifactcache: saving {} files from {} as {}'.format(len(files), prefix, key))
+        fd, listPath = tempfile.mkstemp(dir=self.cacheDir, suffix='.list')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\0'.join(files))
+        tmpPath = '{}.{}.tmp'.format(self.entryPath(key), os.getpid())
+        try:
+            with timing.span('save', key=key, files=len(files)):
+                utils.run(['tar', '-czf', tmpPath, '-C', prefix,
+                        '--null', '--no-recursion', '-T', listPath])
+            os.replace(tmpPath, self.entryPath(key))
+        finally:
+            os.remove(listPath)
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
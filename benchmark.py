@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Hermetic benchmarks of the install pipeline.
+#
+# A local http server serves synthetic tarballs and local git repos
+# stand in for upstream, so downloads, extraction, clones, the
+# scheduler and the installers themselves are timed without the
+# network or a compiler, the builds are stub scripts. Each benchmark
+# runs --iterations times, its median is reported and, with
+# --baseline, compared with a previous run to catch regressions.
+
+import utils
+import buildlog
+import rangedownload
+import downloadcache
+import hostlibs
+import apps
+import ninja_install
+import scheduler
+
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import re
+import shutil
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_SIZE_MB = 32
+DEFAULT_COMPRESSIONS = 'gz,xz'
+DEFAULT_GIT_DEPTH = 200
+DEFAULT_ITERATIONS = 3
+DEFAULT_TOLERANCE = 0.25 # Fraction slower than the baseline that's a regression
+PARALLEL_DOWNLOADS = 4
+SCHEDULER_TASKS = 32
+
+# Extension and tar option of each compression
+COMPRESSIONS = {
+        'none': ('tar', []),
+        'gz': ('tar.gz', ['--gzip']),
+        'bz2': ('tar.bz2', ['--bzip2']),
+        'xz': ('tar.xz', ['--xz']),
+        'zst': ('tar.zst', ['--zstd']),
+}
+
+# A stand in for ninja's bootstrap, it "builds" ninja
+NINJA_CONFIGURE = '''#!/bin/sh
+printf '#!/bin/sh\\necho {ver}\\n' > ninja
+chmod +x ninja
+'''
+
+# A stand in for an autotools library
+LIB_CONFIGURE = '''#!/bin/sh
+prefix=/usr/local
+for arg in "$@"; do
+  case $arg in --prefix=*) prefix=${arg#--prefix=};; esac
+done
+printf 'all:\\n\\techo built > libstub.a\\ninstall:\\n\\tmkdir -p %s/lib\\n\\tcp libstub.a %s/lib\\n' \\
+  "$prefix" "$prefix" > Makefile
+'''
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the install pipeline against local stand ins')
+    parser.add_argument('--sizeMB', type=int, default=DEFAULT_SIZE_MB,
+            help='Uncompressed size of each synthetic tarball (default: {})'.format(DEFAULT_SIZE_MB))
+    parser.add_argument('--compressions', default=DEFAULT_COMPRESSIONS,
+            help='Comma separated compressions of the tarballs, from {} (default: {})'
+                    .format(sorted(COMPRESSIONS), DEFAULT_COMPRESSIONS))
+    parser.add_argument('--gitDepth', type=int, default=DEFAULT_GIT_DEPTH,
+            help='Commits in the history of the git repos (default: {})'.format(DEFAULT_GIT_DEPTH))
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS,
+            help='Runs of each benchmark, the median is reported (default: {})'
+                    .format(DEFAULT_ITERATIONS))
+    parser.add_argument('--only', default=None,
+            help='Only run the benchmarks whose name starts with this')
+    parser.add_argument('--report', default=None,
+            help='Write the results as json to this path')
+    parser.add_argument('--baseline', default=None,
+            help='Results of a previous run, a benchmark slower than it by more than'
+                    ' --tolerance fails')
+    parser.add_argument('--saveBaseline', default=None,
+            help='Write the results as the baseline to this path')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+            help='Fraction slower than the baseline allowed (default: {})'.format(DEFAULT_TOLERANCE))
+    parser.add_argument('--verbose', action='store_true',
+            help='Show the output of the code being benchmarked, it\'s discarded by default')
+    args = parser.parse_args(argv)
+    args.compressions = args.compressions.split(',')
+    for c in args.compressions:
+        if c not in COMPRESSIONS:
+            parser.error('Unknown compression: {}'.format(c))
+    return args
+
+def fillFile(path, size):
+    '''Write size bytes to path, half random and half text so it compresses about 2:1'''
+    block = 64 * 1024
+    text = b''.join('line {} of some compressible source text\n'.format(i).encode()
+            for i in range(block // 80))[:block // 2]
+    with open(path, 'wb') as f:
+        while size > 0:
+            data = (os.urandom(block // 2) + text)[:size]
+            f.write(data)
+            size -= len(data)
+
+def makeTarball(dirPath, name, sizeMB, compression, extraFiles=None):
+    '''Create dirPath/name.<ext> of a directory with sizeMB of 1MB files,
+    extraFiles is a dict of path to contents of executables to add'''
+    srcDir = os.path.join(dirPath, 'src', name)
+    os.makedirs(srcDir)
+    for i in range(sizeMB):
+        fillFile(os.path.join(srcDir, 'data{:04d}'.format(i)), 1024 * 1024)
+    for path, contents in (extraFiles or {}).items():
+        with open(os.path.join(srcDir, path), 'w') as f:
+            f.write(contents)
+        os.chmod(os.path.join(srcDir, path), 0o755)
+    ext, option = COMPRESSIONS[compression]
+    tarPath = os.path.join(dirPath, '{}.{}'.format(name, ext))
+    utils.run(['tar', '-cf', tarPath] + option + ['-C', os.path.dirname(srcDir), name])
+    shutil.rmtree(os.path.dirname(srcDir))
+    return tarPath
+
+def makeGitRepo(path, depth, tag, files=None):
+    '''Create a git repo at path with depth commits, the last tagged tag.
+
+    files is a dict of path to contents of executables in the last commit.
+    '''
+    utils.run(['git', 'init', '-q', path])
+    # fast-import makes a deep history quickly
+    stream = io.BytesIO()
+    for i in range(depth):
+        blob = 'revision {}\n'.format(i).encode() * 256
+        stream.write('commit refs/heads/master\n'
+                'committer bench <bench@localhost> {} +0000\n'
+                'data 10\ncommit {:03d}\n'.format(1000000000 + i, i % 1000).encode())
+        stream.write('M 644 inline file{}\ndata {}\n'.format(i % 16, len(blob)).encode())
+        stream.write(blob + b'\n')
+        if i == depth - 1:
+            for name, contents in (files or {}).items():
+                data = contents.encode()
+                stream.write('M 755 inline {}\ndata {}\n'.format(name, len(data)).encode())
+                stream.write(data + b'\n')
+    stream.write('tag {}\nfrom refs/heads/master\ntagger bench <bench@localhost> 1000000000 +0000\n'
+            'data 4\ntag\n'.format(tag).encode())
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'], input=stream.getvalue(),
+            check=True)
+    utils.run(['git', '-C', path, 'checkout', '-q', 'master'])
+    return 'file://' + path
+
+class Slice:
+    '''At most size bytes of the file f, as a file'''
+
+    def __init__(self, f, size):
+        self.f = f
+        self.size = size
+
+    def read(self, n=-1):
+        if n < 0 or n > self.size:
+            n = self.size
+        data = self.f.read(n)
+        self.size -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    '''Serves the files in the server's root without logging each request.
+
+    With the server's ranges it honours Range requests. If the server's
+    dropAfter is set the first response for each range of a file is cut
+    off after that many bytes, as if the connection dropped.
+    '''
+
+    def translate_path(self, path):
+        return os.path.join(self.server.root, path.split('?', 1)[0].lstrip('/'))
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        f = open(path, 'rb')
+        st = os.fstat(f.fileno())
+        start, end = 0, st.st_size - 1
+        m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if self.server.ranges and m:
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(int(m.group(2)), end)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, st.st_size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        f.seek(start)
+        size = end - start + 1
+        key = (path, end) # A resumed range keeps its end
+        if self.server.dropAfter is not None and self.command == 'GET' and key not in self.server.dropped:
+            self.server.dropped.add(key)
+            size = min(size, self.server.dropAfter)
+            self.close_connection = True
+        return Slice(f, size)
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients which stop reading, as when a download fails, are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+@contextlib.contextmanager
+def serve(root, ranges=True, dropAfter=None):
+    '''Serve root on a free localhost port, yields its base url.
+
+    See QuietHandler for ranges and dropAfter.
+    '''
+    server = Server(('127.0.0.1', 0), QuietHandler)
+    server.root = root
+    server.ranges = ranges
+    server.dropAfter = dropAfter
+    server.dropped = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextlib.contextmanager
+def quiet():
+    '''Discard the output of this process and its children in the with block'''
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+
+def installValues(workDir):
+    '''InstallArgs values which point an installer at workDir'''
+    return {'forceInstall': True,
+            'codePrefixDir': os.path.join(workDir, 'code'),
+            'installPrefixDir': os.path.join(workDir, 'install'),
+            'cacheDir': os.path.join(workDir, 'cache'),
+            'logDir': os.path.join(workDir, 'logs')}
+
+class Bench:
+    '''Runs benchmarks and collects their results'''
+
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+
+    def measure(self, name, func, setup=None, nbytes=0):
+        '''Time func() after setup() --iterations times.
+
+        nbytes is the bytes processed by each run, for its throughput.
+        '''
+        if self.args.only and not name.startswith(self.args.only):
+            return
+        times = []
+        cwd = os.getcwd()
+        for _ in range(self.args.iterations):
+            with contextlib.ExitStack() as stack:
+                if not self.args.verbose:
+                    stack.enter_context(quiet())
+                if setup is not None:
+                    setup()
+                startTime = time.monotonic()
+                try:
+                    func()
+                finally:
+                    os.chdir(cwd)
+                times.append(time.monotonic() - startTime)
+        median = statistics.median(times)
+        result = {'median': median, 'min': min(times), 'max': max(times), 'bytes': nbytes,
+                'mbPerSec': nbytes / (1024 * 1024) / median if nbytes and median else None}
+        self.results[name] = result
+        print('{:<36} {:8.3f}s {:8.3f}s {:8.3f}s {}'.format(name, median, min(times), max(times),
+                '{:8.1f}MB/s'.format(result['mbPerSec']) if result['mbPerSec'] else ''))
+
+def runDownloads(bench, workDir, baseUrl, tarballs):
+    '''Benchmark wget_extract, the download cache and wget_extract_all'''
+    dst = os.path.join(workDir, 'dst')
+    clean = lambda: shutil.rmtree(dst, ignore_errors=True)
+    cacheDir = os.path.join(workDir, 'downloads')
+    for compression, path in tarballs.items():
+        url = baseUrl + os.path.basename(path)
+        size = os.path.getsize(path)
+        bench.measure('wget_extract.stream.{}'.format(compression),
+                lambda: utils.wget_extract(url, dst_path=dst), clean, size)
+        bench.measure('wget_extract.file.{}'.format(compression),
+                lambda: utils.wget_extract(url, tmp_dir=workDir, dst_path=dst, stream=False),
+                clean, size)
+
+        def coldCache():
+            clean()
+            shutil.rmtree(cacheDir, ignore_errors=True)
+        cache = lambda: downloadcache.DownloadCache(cacheDir, 1024 * 1024 * 1024)
+        bench.measure('downloadcache.miss.{}'.format(compression),
+                lambda: utils.wget_extract(url, dst_path=dst, cache=cache()), coldCache, size)
+        bench.measure('downloadcache.hit.{}'.format(compression),
+                lambda: utils.wget_extract(url, dst_path=dst, cache=cache()), clean, size)
+
+        downloads = [(url, os.path.join(dst, str(i))) for i in range(PARALLEL_DOWNLOADS)]
+        bench.measure('wget_extract_all.{}x.{}'.format(PARALLEL_DOWNLOADS, compression),
+                lambda: utils.wget_extract_all(downloads), clean, size * PARALLEL_DOWNLOADS)
+
+def runExtracts(bench, workDir, tarballs):
+    '''Benchmark extracting each tarball with tar's own decompression and
+    with the parallel decompressor, if one is installed'''
+    dst = os.path.join(workDir, 'extract')
+    def clean():
+        shutil.rmtree(dst, ignore_errors=True)
+        os.makedirs(dst)
+    for compression, path in tarballs.items():
+        for name, parallel in [('serial', False), ('parallel', True)]:
+            bench.measure('extract.{}.{}'.format(name, compression),
+                    lambda: utils.event_loop().run_until_complete(
+                        utils.extract_async(path, dst, parallel=parallel)),
+                    clean, os.path.getsize(path))
+
+def runRangeDownloads(bench, workDir, serveDir, tarballs):
+    '''Benchmark rangedownload from servers which honour, refuse or drop
+    Range requests, the last resumes the first try of each segment'''
+    dst = os.path.join(workDir, 'range.tmp')
+    clean = lambda: shutil.rmtree(dst + '.parts', ignore_errors=True)
+    for name, kwargs in [('segmented', {}), ('refused', {'ranges': False}),
+            ('resumed', {'dropAfter': 1024 * 1024})]:
+        with serve(serveDir, **kwargs) as baseUrl:
+            for compression, path in tarballs.items():
+                url = baseUrl + os.path.basename(path)
+                bench.measure('rangedownload.{}.{}'.format(name, compression),
+                        lambda: utils.event_loop().run_until_complete(
+                            rangedownload.download(url, dst)),
+                        clean, os.path.getsize(path))
+
+def runGit(bench, workDir, repoUrl, tag):
+    '''Benchmark clones and updates through a mirror, directly and shallow'''
+    dst = os.path.join(workDir, 'checkout')
+    mirrorDir = os.path.join(workDir, 'mirrors')
+    clean = lambda: shutil.rmtree(dst, ignore_errors=True)
+    def coldMirror():
+        clean()
+        shutil.rmtree(mirrorDir, ignore_errors=True)
+    bench.measure('git_checkout.direct', lambda: utils.git_checkout(repoUrl, dst, tag), clean)
+    bench.measure('git_checkout.mirror.cold',
+            lambda: utils.git_checkout(repoUrl, dst, tag, mirrorDir), coldMirror)
+    bench.measure('git_checkout.mirror.warm',
+            lambda: utils.git_checkout(repoUrl, dst, tag, mirrorDir), clean)
+    bench.measure('git_checkout.shallow',
+            lambda: utils.git_checkout(repoUrl, dst, tag, shallow=True), clean)
+    bench.measure('git_checkout.update',
+            lambda: utils.git_checkout(repoUrl, dst, tag, mirrorDir, update=True))
+
+def runScheduler(bench):
+    '''Benchmark forking SCHEDULER_TASKS no-op tasks, half depending on the other half'''
+    def run():
+        sched = scheduler.Scheduler(jobs=0)
+        half = SCHEDULER_TASKS // 2
+        for i in range(SCHEDULER_TASKS):
+            sched.add(str(i), lambda: 0, [str(i - half)] if i >= half else None)
+        results = sched.run()
+        assert all(r == 0 for r in results.values())
+    bench.measure('scheduler.{}tasks'.format(SCHEDULER_TASKS), run)
+
+def runInstallers(bench, workDir, baseUrl, repoUrl, libTarball):
+    '''Benchmark the ninja installer and a host library build with stub builds'''
+    installDir = os.path.join(workDir, 'installer')
+    def ninja():
+        installer = apps.create('ninja', values=installValues(installDir))
+        assert installer.install() == 0
+    savedUrl = ninja_install.URL
+    ninja_install.URL = repoUrl
+    try:
+        bench.measure('installer.ninja', ninja)
+    finally:
+        ninja_install.URL = savedUrl
+
+    storeDir = os.path.join(workDir, 'hostlibs')
+    url = baseUrl + os.path.basename(libTarball)
+    bench.measure('installer.hostlib',
+            lambda: hostlibs.HostLibs(storeDir).build('stub', url, {}),
+            lambda: shutil.rmtree(storeDir, ignore_errors=True), os.path.getsize(libTarball))
+
+def compare(results, baseline, tolerance):
+    '''The names of the results slower than their baseline by more than tolerance'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            continue
+        limit = base['median'] * (1 + tolerance)
+        if result['median'] > limit:
+            print('benchmark: REGRESSION {} {:.3f}s > {:.3f}s (baseline {:.3f}s + {:.0f}%)'
+                    .format(name, result['median'], limit, base['median'], tolerance * 100))
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    args = parseArgs(argv)
+    bench = Bench(args)
+    workDir = tempfile.mkdtemp(prefix='install-benchmark-')
+    try:
+        serveDir = os.path.join(workDir, 'serve')
+        os.makedirs(serveDir)
+        buildlog.start(os.path.join(workDir, 'logs'))
+        print('benchmark: creating {}MB tarballs {} and a {} commit git repo'
+                .format(args.sizeMB, args.compressions, args.gitDepth))
+        tarballs = dict((c, makeTarball(serveDir, 'synthetic-{}'.format(c), args.sizeMB, c))
+                for c in args.compressions)
+        libTarball = makeTarball(serveDir, 'stublib-1.0', 1, 'gz', {'configure': LIB_CONFIGURE})
+        tag = 'v{}'.format(ninja_install.DEFAULT_VER)
+        repoUrl = makeGitRepo(os.path.join(workDir, 'repo'), args.gitDepth, tag,
+                {'configure.py': NINJA_CONFIGURE.format(ver=ninja_install.DEFAULT_VER)})
+
+        print('{:<36} {:>9} {:>9} {:>9}'.format('benchmark', 'median', 'min', 'max'))
+        with serve(serveDir) as baseUrl:
+            runDownloads(bench, workDir, baseUrl, tarballs)
+            runRangeDownloads(bench, workDir, serveDir, tarballs)
+            runGit(bench, workDir, repoUrl, tag)
+            runScheduler(bench)
+            runInstallers(bench, workDir, baseUrl, repoUrl, libTarball)
+        runExtracts(bench, workDir, tarballs)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    report = {'config': {'sizeMB': args.sizeMB, 'compressions': args.compressions,
+            'gitDepth': args.gitDepth, 'iterations': args.iterations},
+            'benchmarks': bench.results}
+    for path in [args.report, args.saveBaseline]:
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=1, sort_keys=True)
+            print('benchmark: results written to', path)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(bench.results, json.load(f), args.tolerance)
+        if regressions:
+            return 1
+        print('benchmark: no regressions against', args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
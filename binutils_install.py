@@ -16,10 +16,16 @@
 
 import utils
 import parseinstallargs
+import jobserver
+import manifest
+import rambuild
+import timing
+import buildlog
 
 import subprocess
 import sys
 import os
+import time
 import shutil
 import multiprocessing
 import traceback
@@ -32,36 +38,29 @@ GDB_VER='7.8.50'
 DEFAULT_CROSS_DIR='cross'
 TARGET='arm-eabi'
 TARGET_DASH='-'
+BUILD_SIZE_MB = 1024 # Estimated size of the build directory
 
 class Installer:
     '''Installer'''
 
     def __init__(self, defaultVer=DEFAULT_VER, defaultCodePrefixDir=None,
             defaultInstallPrefixDir=None, defaultForceInstall=None,
-            defaultCrossDir=DEFAULT_CROSS_DIR, defaultTarget=None):
-        '''See parseinstallargs for defaults prefixes'''
+            defaultCrossDir=DEFAULT_CROSS_DIR, defaultTarget=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         self.args = parseinstallargs.InstallArgs(APP, defaultVer, defaultCodePrefixDir,
-                defaultInstallPrefixDir, defaultForceInstall, defaultCrossDir, defaultTarget)
+                defaultInstallPrefixDir, defaultForceInstall, defaultCrossDir, defaultTarget,
+                values=values)
+
+    def isInstalled(self):
+        return manifest.fromArgs(self.args).isInstalled(self.args.app, self.args.ver,
+                self.args.target)
 
     def install(self):
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        try:
-            theApp = AN_APP
-            if self.args.target != '':
-                theApp = '{}-{}'.format(self.args.target, theApp)
-
-            theApp = os.path.join(dst_dir, theApp)
-            output = subprocess.check_output([theApp, '--version'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
@@ -71,28 +70,40 @@ class Installer:
             if self.args.target != '':
                 code_dir = os.path.join(code_dir, self.args.target)
             code_dir = os.path.join(code_dir, self.args.app)
-            if self.args.forceInstall:
+            if self.args.forceInstall and not self.args.rebuild:
                 shutil.rmtree(code_dir, ignore_errors=True)
-            os.makedirs(code_dir)
+            os.makedirs(code_dir, exist_ok=self.args.rebuild)
 
-            utils.git('clone', [URL, code_dir])
-            os.chdir(code_dir)
             version = self.args.ver.replace('.','_')
-            utils.git('checkout', ['binutils-{}'.format(version)])
-            os.mkdir('build')
-            os.chdir('build')
+            utils.git_checkout(URL, code_dir, 'binutils-{}'.format(version),
+                    utils.git_mirror_dir(self.args), self.args.shallow,
+                    update=self.args.rebuild)
+            # Build in code_dir/build, or in RAM with --buildInRam
+            with rambuild.buildDir(self.args, os.path.join(code_dir, 'build'),
+                    BUILD_SIZE_MB) as build_dir:
+                os.makedirs(build_dir, exist_ok=True)
+                os.chdir(build_dir)
 
-            configureCmd = '../configure --prefix={} --disable-nls'.format(
-                    self.args.installPrefixDir)
-            if self.args.target != '':
-                configureCmd += ' --target={}'.format(self.args.target)
-            subprocess.run(configureCmd,
-                    shell=True,
-                    stdout=subprocess.DEVNULL) # Too much logging overflows 4MB travis-ci log limit
-            subprocess.run('make all -j {}'.format(multiprocessing.cpu_count()),
-                    shell=True,
-                    stdout=subprocess.DEVNULL) # Too much logging overflows 4MB travis-ci log limit
-            utils.bash('make install')
+                configureCmd = [os.path.join(code_dir, 'configure'),
+                        '--prefix={}'.format(self.args.installPrefixDir), '--disable-nls']
+                if self.args.target != '':
+                    configureCmd.append('--target={}'.format(self.args.target))
+                # A rebuild reuses the existing configuration if it's the same
+                if not (self.args.rebuild and utils.configured_with(build_dir, configureCmd)):
+                    with timing.span('configure'):
+                        buildlog.run(configureCmd, 'configure')
+                    utils.mark_configured(build_dir, configureCmd)
+                with timing.span('make'):
+                    buildlog.run(jobserver.makeCmd(['all']), 'make',
+                            pass_fds=jobserver.fds())
+                stage_dir = os.path.join(build_dir, 'stage')
+                shutil.rmtree(stage_dir, ignore_errors=True)
+                with timing.span('install'):
+                    buildlog.run(['make', 'install', 'DESTDIR={}'.format(stage_dir)], 'install',
+                            pass_fds=jobserver.fds())
+                    files = utils.install_staged(stage_dir, self.args.installPrefixDir)
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, self.args.target, files=files)
 
         return retval
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Per step build logs.
+#
+# run() starts a command with its stdout and stderr on a pipe which is
+# read in large blocks and written to <logDir>/<app>/<nn>-<step>.log.gz.
+# Only the last TAIL_LINES lines are kept in memory, they're printed if
+# the step fails. The console just gets a progress line. The command is
+# run by utils' asyncio runner so several steps can be logged at once.
+
+import timing
+import utils
+
+import collections
+import gzip
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ENV_NAME = 'INSTALL_LOG_DIR'
+READ_SIZE = 64 * 1024
+TAIL_LINES = 50
+PROGRESS_INTERVAL = 0.5 # Seconds between progress updates on a terminal
+QUIET_INTERVAL = 60 # Seconds between progress lines otherwise, keeps CI alive
+
+_steps = 0
+
+def start(dirPath):
+    '''Write the logs of this process and its children in dirPath'''
+    os.makedirs(dirPath, exist_ok=True)
+    os.environ[ENV_NAME] = dirPath
+
+def logDir():
+    dirPath = os.environ.get(ENV_NAME)
+    if not dirPath:
+        dirPath = os.path.join(tempfile.gettempdir(), 'vendor-install-tools-logs')
+    return os.path.join(dirPath, timing.app() or 'install')
+
+def logPath(step):
+    '''A new log file for step, numbered so they sort in the order run'''
+    global _steps
+    _steps += 1
+    name = re.sub(r'[^A-Za-z0-9.+-]+', '_', step).strip('_')
+    dirPath = logDir()
+    os.makedirs(dirPath, exist_ok=True)
+    return os.path.join(dirPath, '{:02d}-{}.log.gz'.format(_steps, name))
+
+def run(cmd, step, cwd=None, env=None, pass_fds=(), echo=False, check=True):
+    '''Run cmd to completion logging its output as step, see run_async'''
+    return utils.event_loop().run_until_complete(run_async(cmd, step, cwd=cwd, env=env,
+            pass_fds=pass_fds, echo=echo, check=check))
+
+async def run_async(cmd, step, cwd=None, env=None, pass_fds=(), echo=False, check=True):
+    '''Run cmd, a list of the program and its arguments, logging its output
+    as step, returns its exit code.
+
+    With echo the output is also copied to the console. If it fails the
+    tail of its output is printed and, with check, CalledProcessError
+    is raised. If it's cancelled cmd is killed.
+    '''
+    path = logPath(step)
+    tail = collections.deque(maxlen=TAIL_LINES)
+    partial = b''
+    lines = 0
+    startTime = time.monotonic()
+    lastProgress = startTime
+    tty = sys.stdout.isatty() and not echo
+    interval = PROGRESS_INTERVAL if tty else QUIET_INTERVAL
+    print('buildlog: {} logging to {}'.format(step, path))
+    sys.stdout.flush()
+    with gzip.open(path, 'wb', compresslevel=1) as log:
+        p = await utils.start_async(cmd, cwd=cwd, env=env, pass_fds=pass_fds,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            while True:
+                data = await p.stdout.read(READ_SIZE)
+                if not data:
+                    break
+                log.write(data)
+                if echo:
+                    sys.stdout.buffer.write(data)
+                    sys.stdout.flush()
+                parts = (partial + data).split(b'\n')
+                partial = parts.pop()
+                tail.extend(parts)
+                lines += len(parts)
+                now = time.monotonic()
+                if not echo and now - lastProgress >= interval:
+                    lastProgress = now
+                    _progress(step, lines, now - startTime, tail, tty)
+        except BaseException:
+            if p.returncode is None:
+                await utils.kill_async(p)
+            raise
+        returncode = await utils.wait_async(p, cmd, check=False)
+    if partial:
+        tail.append(partial)
+        lines += 1
+    if tty:
+        sys.stdout.write('\r\033[K')
+    print('buildlog: {} {} in {:.0f}s, {} lines'.format(step,
+            'done' if returncode == 0 else 'FAILED exitcode={}'.format(returncode),
+            time.monotonic() - startTime, lines))
+    if returncode != 0:
+        print('buildlog: last {} lines of {}:'.format(len(tail), path))
+        for line in tail:
+            print('  ' + line.decode('utf-8', 'replace').rstrip())
+        sys.stdout.flush()
+        if check:
+            raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
+
+def _progress(step, lines, elapsed, tail, tty):
+    last = tail[-1].decode('utf-8', 'replace').strip() if tail else ''
+    line = '{} {}: {:.0f}s {} lines: {}'.format(timing.app(), step, elapsed, lines, last)
+    if tty:
+        sys.stdout.write('\r\033[K' + line[:150])
+    else:
+        sys.stdout.write(line[:150] + '\n')
+    sys.stdout.flush()
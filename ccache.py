@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Compiler cache for the native compiles of every build.
+#
+# enable() puts a directory of symlinks to ccache named after the host
+# compilers at the front of PATH and points CC and CXX at them, so
+# configure, make and ct-ng's build/host compiler all go through ccache.
+# Everything started afterwards, including the processes install.py
+# forks, shares the one cache.
+
+import utils
+
+import os
+import re
+import shutil
+import subprocess
+
+DEFAULT_SIZE = '10G'
+
+# The --print-stats counters of direct and preprocessed hits. ccache 3.x
+# names them cache_hit_direct and cache_hit_cpp, 4.x renamed them, each
+# prints only its own pair so the hits are the sum of all four.
+HIT_KEYS = ['cache_hit_direct', 'cache_hit_cpp', 'direct_cache_hit', 'preprocessed_cache_hit']
+
+def fromArgs(args):
+    '''The Ccache for InstallArgs args or None if not enabled or not installed'''
+    if not args.ccache:
+        return None
+    if shutil.which('ccache') is None:
+        print('ccache: not found, building without it')
+        return None
+    return Ccache(os.path.join(args.cacheDir, 'ccache'), args.ccacheSize)
+
+class Ccache:
+    '''A ccache directory limited to maxSize, e.g. "10G"'''
+
+    def __init__(self, cacheDir, maxSize=DEFAULT_SIZE):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.binDir = os.path.join(cacheDir, 'bin')
+
+    def enable(self):
+        '''Route the compilers of this process and its children through ccache'''
+        os.makedirs(self.binDir, exist_ok=True)
+        os.environ['CCACHE_DIR'] = self.cacheDir
+        utils.run(['ccache', '-M', self.maxSize], stdout=subprocess.DEVNULL)
+
+        ccache = shutil.which('ccache')
+        compilers = {'CC': os.environ.get('CC', 'gcc'), 'CXX': os.environ.get('CXX', 'g++')}
+        names = set(['cc', 'c++', 'gcc', 'g++'] + [os.path.basename(c) for c in compilers.values()])
+        for name in names:
+            link = os.path.join(self.binDir, name)
+            if not os.path.lexists(link):
+                os.symlink(ccache, link)
+        for var, compiler in compilers.items():
+            os.environ[var] = os.path.join(self.binDir, os.path.basename(compiler))
+        if os.environ.get('PATH', '').split(os.pathsep)[0] != self.binDir:
+            os.environ['PATH'] = os.pathsep.join([self.binDir, os.environ.get('PATH', '')])
+        print('ccache: enabled dir={} maxSize={}'.format(self.cacheDir, self.maxSize))
+
+    def stats(self):
+        '''A dict with the cache's total hits and misses'''
+        env = dict(os.environ, CCACHE_DIR=self.cacheDir)
+        try:
+            # ccache 3.7 and later, see HIT_KEYS
+            output = utils.output(['ccache', '--print-stats'], env=env,
+                    stderr=subprocess.DEVNULL)
+            values = {}
+            for line in output.splitlines():
+                fields = line.split('\t')
+                if len(fields) == 2 and fields[1].isdigit():
+                    values[fields[0]] = int(fields[1])
+            return {'hits': sum(values.get(k, 0) for k in HIT_KEYS),
+                    'misses': values.get('cache_miss', 0)}
+        except subprocess.CalledProcessError:
+            pass
+        output = utils.output(['ccache', '-s'], env=env)
+        stats = {'hits': 0, 'misses': 0}
+        for line in output.splitlines():
+            m = re.match(r'\s*cache (hit \((direct|preprocessed)\)|miss)\s+(\d+)', line)
+            if m:
+                stats['misses' if m.group(1) == 'miss' else 'hits'] += int(m.group(3))
+        return stats
+
+    def report(self, before):
+        '''Print the hit rate since the stats() before'''
+        after = self.stats()
+        hits = after['hits'] - before['hits']
+        misses = after['misses'] - before['misses']
+        total = hits + misses
+        print('ccache: {} hits {} misses hit rate {:.0f}%'.format(hits, misses,
+                100.0 * hits / total if total else 0.0))
+        return {'hits': hits, 'misses': misses}
@@ -16,10 +16,15 @@
 
 import utils
 import parseinstallargs
+import jobserver
+import manifest
+import timing
+import buildlog
 
 import subprocess
 import sys
 import os
+import time
 import traceback
 import shutil
 
@@ -33,48 +38,57 @@ class Installer:
     '''Installer for crosstool-ng.'''
 
     def __init__(self, defaultVer=DEFAULT_VER, defaultCodePrefixDir=None,
-            defaultInstallPrefixDir=None, defaultForceInstall=None):
-        '''See parseinstallargs for defaults prefixes'''
+            defaultInstallPrefixDir=None, defaultForceInstall=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         self.args = parseinstallargs.InstallArgs(APP, defaultVer, defaultCodePrefixDir,
-                defaultInstallPrefixDir, defaultForceInstall)
+                defaultInstallPrefixDir, defaultForceInstall, values=values)
+
+    def isInstalled(self):
+        return manifest.fromArgs(self.args).isInstalled(self.args.app, self.args.ver)
 
     def install(self):
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        try:
-            dst = os.path.join(dst_dir, self.args.app)
-            output = subprocess.check_output([dst, 'version'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
             print('compiling {app} {ver}'
                     .format(app=self.args.app, ver=self.args.ver))
             code_dir = os.path.join(self.args.codePrefixDir, self.args.app)
-            if self.args.forceInstall:
+            if self.args.forceInstall and not self.args.rebuild:
                 shutil.rmtree(code_dir, ignore_errors=True)
-            os.makedirs(code_dir)
+            os.makedirs(code_dir, exist_ok=self.args.rebuild)
 
-            utils.git('clone', [URL, code_dir])
-            os.chdir(code_dir)
             if CHECKOUT_SHA1:
               checkout_ver = self.args.ver
             else:
               checkout_ver = 'crosstool-ng-{}'.format(self.args.ver)
-            utils.git('checkout', [checkout_ver])
+            utils.git_checkout(URL, code_dir, checkout_ver,
+                    utils.git_mirror_dir(self.args), self.args.shallow,
+                    update=self.args.rebuild)
+            os.chdir(code_dir)
 
-            subprocess.check_call(['./bootstrap'])
-            subprocess.check_call(['./configure', '--prefix={}'.format(self.args.installPrefixDir)])
-            subprocess.check_call(['make'])
-            subprocess.check_call(['make', 'install'])
+            # A rebuild reuses the existing configuration if it's the same,
+            # make reruns configure itself if it's out of date
+            configureCmd = ['./configure', '--prefix={}'.format(self.args.installPrefixDir)]
+            if not (self.args.rebuild and utils.configured_with(code_dir, configureCmd)):
+                with timing.span('configure'):
+                    buildlog.run(['./bootstrap'], 'bootstrap')
+                    buildlog.run(configureCmd, 'configure')
+                utils.mark_configured(code_dir, configureCmd)
+            with timing.span('make'):
+                buildlog.run(['make'], 'make', pass_fds=jobserver.fds())
+            stage_dir = os.path.join(code_dir, 'stage')
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            with timing.span('install'):
+                buildlog.run(['make', 'install', 'DESTDIR={}'.format(stage_dir)], 'install',
+                        pass_fds=jobserver.fds())
+                files = utils.install_staged(stage_dir, self.args.installPrefixDir)
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, files=files)
 
         return retval
 
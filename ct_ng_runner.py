@@ -16,6 +16,13 @@
 
 import utils
 import parseinstallargs
+import jobserver
+import artifactcache
+import manifest
+import rambuild
+import timing
+import buildlog
+import crosstool_ng_install
 
 import subprocess
 import sys
@@ -33,6 +40,49 @@ DEFAULT_VER=GCC_VER
 AN_APP='gcc'
 GCC_GIT_REPO_URL = 'https://github.com/winksaville/gcc.git'
 CHECKOUT_LABEL='wink-intr-attr'
+GCC_CUSTOM_LOCATION='~/prgs/ct-ng-gcc-{target}'
+BUILD_SIZE_MB = 6144 # Estimated size of the work directory with its saved states
+
+def writeConfig(src, dst, overrides):
+    '''Copy a ct-ng .config from src to dst replacing the values in overrides.
+
+    overrides is a dict of CT_xxx names to values, a value of None
+    means the option is not set. Options not in src are appended.
+    '''
+    with open(dst, 'w') as f:
+        f.write(configText(src, overrides))
+
+def configText(src, overrides):
+    '''The ct-ng .config src with the values in overrides, see writeConfig'''
+    remaining = dict(overrides)
+    lines = []
+    with open(src) as f:
+        for line in f:
+            name = None
+            if line.startswith('CT_'):
+                name = line.split('=', 1)[0]
+            elif line.startswith('# CT_') and line.rstrip().endswith(' is not set'):
+                name = line.split()[1]
+            if name in remaining:
+                line = configLine(name, remaining.pop(name))
+            lines.append(line)
+    for name in sorted(remaining):
+        lines.append(configLine(name, remaining[name]))
+    return ''.join(lines)
+
+def configLine(name, value):
+    if value is None:
+        return '# {} is not set\n'.format(name)
+    elif value is True:
+        return '{}=y\n'.format(name)
+    elif isinstance(value, int):
+        return '{}={}\n'.format(name, value)
+    else:
+        return '{}="{}"\n'.format(name, value)
+
+def tarballsDir(args):
+    '''The directory of upstream tarballs shared by all ct-ng builds'''
+    return os.path.join(args.cacheDir, 'ct-ng-tarballs')
 
 class Builder:
     '''Buidler for ct-ng builds'''
@@ -40,8 +90,8 @@ class Builder:
     def __init__(self, defaultVer=DEFAULT_VER, defaultCodePrefixDir=None,
             defaultInstallPrefixDir=None, defaultForceInstall=None,
             defaultCrossDir=DEFAULT_CROSS_DIR, defaultTarget=None,
-            extraFlags=None):
-        '''See parseinstallargs for defaults prefixes'''
+            extraFlags=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         if extraFlags is None:
             extraFlags = ''
         self.extraFlags = extraFlags
@@ -52,65 +102,218 @@ class Builder:
         self.args = parseinstallargs.InstallArgs(app, defaultVer,
                 defaultCodePrefixDir,
                 defaultInstallPrefixDir,
-                defaultForceInstall, defaultCrossDir, defaultTarget)
+                defaultForceInstall, defaultCrossDir, defaultTarget, values=values)
+        if self.args.target != '':
+            self.args.installPrefixDir = '{}/{}'.format(
+                    self.args.installPrefixDir, self.args.target)
+            self.args.app = '{}-{}'.format(self.args.target, self.args.app)
+        self._gccSha = None
+
+    def usesGccGit(self):
+        '''True if gcc is built from the CHECKOUT_LABEL branch of GCC_GIT_REPO_URL'''
+        return self.args.target == X86_64_TARGET or self.args.target == I386_TARGET
+
+    def gccPath(self):
+        '''Where the gcc from git is checked out, each target has its own copy'''
+        return os.path.expanduser(GCC_CUSTOM_LOCATION.format(target=self.args.target))
 
+    def gccSha(self):
+        '''The commit CHECKOUT_LABEL is at, resolved once so the toolchain
+        built is the one its artifact key names, or None if unknown'''
+        if self._gccSha is None and self.args.resume and os.path.isdir(self.gccPath()):
+            # A resumed build keeps its checkout, whatever the branch is at now
+            self._gccSha = utils.git_resolve(GCC_GIT_REPO_URL, CHECKOUT_LABEL,
+                    offline=True, checkout=self.gccPath())
+        if self._gccSha is None:
+            self._gccSha = utils.git_resolve(GCC_GIT_REPO_URL, CHECKOUT_LABEL,
+                    utils.git_mirror_dir(self.args), self.args.offline, self.gccPath())
+        return self._gccSha
+
+    def source(self):
+        '''The commit of gcc built, recorded in the manifest, or None'''
+        return self.gccSha() if self.usesGccGit() else None
+
+    def installOverrides(self):
+        '''The overrides of the config which change what's installed'''
+        return {'CT_PREFIX_DIR': self.args.installPrefixDir}
+
+    def configPath(self):
+        thisDir = os.path.dirname(os.path.realpath(__file__))
+        return os.path.abspath('{}/config.{}'.format(thisDir, self.args.target))
+
+    def isInstalled(self):
+        '''True if this toolchain is installed, checked locally. For the
+        targets built from git the commit recorded when it was installed
+        is used, whether or not the branch has moved since.'''
+        installed = manifest.fromArgs(self.args)
+        gccSha = None
+        if self.usesGccGit():
+            entry = installed.lookup(self.args.app, self.args.target)
+            gccSha = None if entry is None else entry.get('source')
+            if gccSha is None:
+                return False
+        return installed.isInstalled(self.args.app, self.args.ver,
+                self.args.target, self.artifactKey(self.configPath(), gccSha))
+
+    def isCached(self):
+        '''True if the artifact cache has this toolchain'''
+        cache = artifactcache.fromArgs(self.args)
+        return cache is not None and cache.contains(self.artifactKey(self.configPath()))
+
+    def install(self):
+        return self.build()
 
     def build(self):
-        if self.args.target is None:
+        if self.args.target == '':
             print('No default target expecting something like "x86_64-unknown-elf"')
             return 1
 
-        self.args.installPrefixDir = '{}/{}'.format(
-                self.args.installPrefixDir, self.args.target)
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        self.args.app = '{}-{}'.format(self.args.target, self.args.app)
-
-        try:
-            dst = os.path.join(dst_dir, self.args.app)
-            output = subprocess.check_output([dst, '--version'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
+            src = self.configPath()
+            cache = artifactcache.fromArgs(self.args)
+            key = self.artifactKey(src)
+            if self.usesGccGit() and self.gccSha() is None:
+                # Without the commit there's no telling what a cached one has
+                print('ct_ng_runner: {} of {} is unknown, not using the artifact cache'
+                        .format(CHECKOUT_LABEL, GCC_GIT_REPO_URL))
+                cache = None
+            if cache is not None and cache.contains(key):
+                shutil.rmtree(self.args.installPrefixDir, ignore_errors=True)
+                cache.restore(key, self.args.installPrefixDir)
+                manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                        self.args.installPrefixDir, self.args.target, key, source=self.source())
+                return retval
+
             print('compiling {app} {ver}'
                     .format(app=self.args.app, ver=self.args.ver))
             code_dir = os.path.join(self.args.codePrefixDir,
                     '{}/{}'.format(self.args.crossDir, self.args.target))
-            if self.args.forceInstall:
-                shutil.rmtree(code_dir, ignore_errors=True)
-            os.makedirs(code_dir)
-
-            if self.args.target == X86_64_TARGET or self.args.target == I386_TARGET:
-                # Get gcc from git which supports attribute(interrupt)
-                # gcc_path must match GCC_CUSTOM_LOCATION in config.x86_64-unknown-elf
-                gcc_path = os.path.expanduser(os.path.join('~/prgs', 'ct-ng-gcc'))
+
+            # ct-ng's work directory is code_dir, or in RAM with --buildInRam
+            # where it's kept if the build fails so it can be resumed.
+            with rambuild.buildDir(self.args, code_dir, BUILD_SIZE_MB,
+                    keepOnFailure=True) as work_dir:
+                self.compile(src, code_dir, work_dir)
+
+            # x-tools/<target> is this toolchain's alone so all of it is recorded
+            if cache is not None:
+                cache.save(key, self.args.installPrefixDir)
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, self.args.target, key, source=self.source())
+
+        return retval
+
+    def compile(self, src, code_dir, work_dir):
+        '''Build the toolchain configured by src with ct-ng in work_dir'''
+        state_dir = os.path.join(work_dir, self.args.target, 'state')
+        resuming = self.args.resume and os.path.isdir(state_dir)
+        if self.args.forceInstall and not resuming:
+            shutil.rmtree(code_dir, ignore_errors=True)
+            shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(code_dir, exist_ok=resuming)
+        os.makedirs(work_dir, exist_ok=True)
+
+        # Install where we were asked to rather than where the config says,
+        # all targets share one directory of upstream tarballs. The state
+        # at the start of each step is saved in state_dir so a failed
+        # build can be restarted from the step that failed.
+        tarballs = tarballsDir(self.args)
+        os.makedirs(tarballs, exist_ok=True)
+        overrides = dict(self.installOverrides(),
+                CT_WORK_DIR=work_dir,
+                CT_LOCAL_TARBALLS_DIR=tarballs,
+                CT_SAVE_TARBALLS=True,
+                CT_DEBUG_CT=True,
+                CT_DEBUG_CT_SAVE_STEPS=True,
+                CT_DEBUG_CT_SAVE_STEPS_GZIP=True)
+        if self.usesGccGit():
+            # Get gcc from git which supports attribute(interrupt), each
+            # target has its own copy so they can be built concurrently.
+            gcc_path = self.gccPath()
+            overrides['CT_CC_GCC_CUSTOM_LOCATION'] = gcc_path
+            if not (resuming and os.path.isdir(gcc_path)):
                 shutil.rmtree(gcc_path, ignore_errors=True)
                 print('gcc_install: gcc_path=', gcc_path)
-                utils.git('clone', [GCC_GIT_REPO_URL, gcc_path, '--depth', '1', '--single-branch',
-                    '--branch', CHECKOUT_LABEL])
-                os.chdir(gcc_path)
-                
-            thisDir = os.path.dirname(os.path.realpath(__file__))
-            src = os.path.abspath('{}/config.{}'.format(thisDir, self.args.target))
-            dst = os.path.abspath('{}/.config'.format(code_dir))
-            print('config src=', src)
-            print('config dst=', dst)
-            shutil.copy2(src, dst)
-            os.chdir(code_dir)
-
-            # Build and install app's
-            subprocess.check_call(['ct-ng', 'build.4'])
+                # Only the tip of the branch is built, its history is
+                # several GB so it's always fetched at depth 1. The commit
+                # resolved for the artifact key is the one checked out.
+                utils.git_checkout(GCC_GIT_REPO_URL, gcc_path, self.gccSha() or CHECKOUT_LABEL,
+                        utils.git_mirror_dir(self.args), shallow=True)
 
-        return retval
+        dst = os.path.abspath('{}/.config'.format(code_dir))
+        print('config src=', src)
+        print('config dst=', dst)
+        os.chdir(code_dir)
+
+        # Seed the shared tarballs, one target at a time so a tarball
+        # needed by several targets is only downloaded by the first.
+        writeConfig(src, dst, dict(overrides,
+                CT_FORBID_DOWNLOAD=True if self.args.offline else None))
+        with utils.locked(tarballs + '.lock'), timing.span('download'):
+            buildlog.run(['ct-ng', 'source'], 'source')
+
+        # Everything is local now so the build mustn't download
+        overrides['CT_FORBID_DOWNLOAD'] = True
+        writeConfig(src, dst, overrides)
+
+        cmd = []
+        if resuming:
+            step = self.restartStep(state_dir)
+            if step is not None:
+                print('ct_ng_runner: resuming {} at step {}'.format(self.args.target, step))
+                cmd = ['RESTART={}'.format(step)]
+
+        # Build and install app's, ct-ng passes an explicit -j to the makes
+        # it runs so they can't use the jobserver, lease the jobs instead.
+        # A third of the jobs so the three toolchains in 'all' build side by side.
+        with jobserver.lease(max(4, (jobserver.budget() + 2) // 3)) as jobs:
+            with timing.span('make', jobs=jobs, restart=cmd):
+                try:
+                    buildlog.run(['ct-ng', 'build.{}'.format(jobs)] + cmd, 'build',
+                            pass_fds=jobserver.fds())
+                except subprocess.CalledProcessError:
+                    step = self.restartStep(state_dir)
+                    if step is not None:
+                        print('ct_ng_runner: {} failed in step {}, use --resume to restart there'
+                                .format(self.args.target, step))
+                    raise
+
+        # The saved states are only needed to restart a failed build
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    def restartStep(self, stateDir):
+        '''The step a failed build should restart at or None.
+
+        ct-ng saves the state at the start of each step, so the
+        last step with a saved state is the one which failed.
+        '''
+        if not os.path.isdir(stateDir):
+            return None
+        output = utils.output(['ct-ng', 'list-steps'])
+        steps = [line.strip()[2:] for line in output.splitlines()
+                if line.strip().startswith('- ')]
+        saved = [step for step in steps if os.path.isdir(os.path.join(stateDir, step))]
+        if len(saved) == 0:
+            return None
+        return saved[-1]
+
+    def artifactKey(self, configPath, gccSha=None):
+        '''The artifact cache key of this toolchain built with configPath,
+        as configured to install in to its prefix, and for the targets
+        built from git the commit of gcc, gccSha or if None the one
+        the branch is at, which may ask the server'''
+        if gccSha is None:
+            gccSha = self.source()
+        return artifactcache.key(app=self.args.app, ver=self.args.ver,
+                target=self.args.target, config=configText(configPath, self.installOverrides()),
+                ctNgVer=crosstool_ng_install.DEFAULT_VER, gccLabel=CHECKOUT_LABEL, gccSha=gccSha)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+import utils
+import rangedownload
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+def fromArgs(args):
+    '''The DownloadCache described by the InstallArgs args'''
+    return DownloadCache(os.path.join(args.cacheDir, 'downloads'),
+            args.downloadCacheSize * 1024 * 1024, args.offline)
+
+def sha256File(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class DownloadCache:
+    '''Persistent cache of downloaded files.
+
+    Entries are keyed by the sha256 of their url and their content is
+    verified against the recorded (or expected) sha256 on every hit.
+    When the cache grows beyond maxBytes the least recently used
+    entries are evicted. In offline mode a miss is an error.
+    '''
+
+    def __init__(self, cacheDir, maxBytes, offline=False):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.offline = offline
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def entryPath(self, url):
+        '''The path of url's entry, its metadata is in entryPath + ".json"'''
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        name = os.path.basename(url.rstrip('/')) or 'index'
+        return os.path.join(self.cacheDir, '{}-{}'.format(key[:16], name))
+
+    def lookup(self, url, sha256=None):
+        '''Returns the path of a valid entry for url or None'''
+        path = self.entryPath(url)
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url or (sha256 is not None and meta.get('sha256') != sha256):
+            return None
+        try:
+            if os.path.getsize(path) != meta.get('size') or sha256File(path) != meta.get('sha256'):
+                print('downloadcache: corrupt entry for', url)
+                self.remove(path)
+                return None
+        except OSError:
+            return None
+        # Mark it as recently used
+        os.utime(path)
+        return path
+
+    def fetch(self, url, timeout=20, sha256=None):
+        '''Returns the path of the cached copy of url, see fetchAsync'''
+        return utils.event_loop().run_until_complete(self.fetchAsync(url, timeout, sha256))
+
+    async def fetchAsync(self, url, timeout=20, sha256=None):
+        '''Returns the path of the cached copy of url downloading it if needed'''
+        path = self.lookup(url, sha256)
+        if path is not None:
+            print('downloadcache: hit url={} path={}'.format(url, path))
+            return path
+        if self.offline:
+            raise FileNotFoundError('downloadcache: offline and {} is not cached'.format(url))
+
+        path = self.entryPath(url)
+        print('downloadcache: miss url={} path={}'.format(url, path))
+        # The partial download is kept for the next attempt unless
+        # another process is downloading url, then this one starts afresh
+        with open(path + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                partPath = path + '.part'
+                keep = True
+            except BlockingIOError:
+                partPath = '{}.{}-{}.part'.format(path, os.getpid(), id(url))
+                keep = False
+            try:
+                actual = await rangedownload.download(url, partPath, timeout=timeout, sha256=sha256)
+                self.add(url, partPath, sha256, actualSha256=actual)
+            finally:
+                if not keep:
+                    shutil.rmtree(partPath + '.parts', ignore_errors=True)
+        return path
+
+    def add(self, url, srcPath, sha256=None, actualSha256=None):
+        '''Move srcPath in to the cache as the entry for url.
+
+        actualSha256 is the sha256 of srcPath if the caller already knows it.
+        '''
+        actual = actualSha256
+        if actual is None:
+            actual = sha256File(srcPath)
+        if sha256 is not None and actual != sha256:
+            raise ValueError('downloadcache: {} has sha256 {} expected {}'
+                    .format(url, actual, sha256))
+        path = self.entryPath(url)
+        meta = {'url': url, 'sha256': actual, 'size': os.path.getsize(srcPath)}
+        os.replace(srcPath, path)
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.json.tmp', path + '.json')
+        self.evict(keep=path)
+
+    def remove(self, path):
+        for p in [path + '.json', path]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def evict(self, keep=None):
+        '''Remove the least recently used entries until under maxBytes'''
+        entries = []
+        total = 0
+        for name in os.listdir(self.cacheDir):
+            path = os.path.join(self.cacheDir, name)
+            if name.endswith(('.json', '.part', '.parts', '.tmp', '.lock')):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if path == keep:
+                continue
+            print('downloadcache: evicting', path)
+            self.remove(path)
+            total -= size
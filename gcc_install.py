@@ -16,6 +16,14 @@
 
 import utils
 import parseinstallargs
+import jobserver
+import downloadcache
+import artifactcache
+import manifest
+import hostlibs
+import rambuild
+import timing
+import buildlog
 
 import argparse
 import multiprocessing
@@ -23,6 +31,7 @@ import os
 import shutil
 import subprocess
 import sys
+import time
 import traceback
 
 DEFAULT_VER='5.3.0'
@@ -38,6 +47,12 @@ GMP_URL  = 'http://ftp.gnu.org/gnu/gmp/gmp-6.0.0a.tar.xz'
 MPFR_URL = 'http://ftp.gnu.org/gnu/mpfr/mpfr-3.1.3.tar.xz'
 MPC_URL  = 'http://ftp.gnu.org/gnu/mpc/mpc-1.0.3.tar.gz'
 #ISL_URL  = 'ftp://gcc.gnu.org/pub/gcc/infrastructure/isl-0.14.tar.bz2'
+HOST_LIBS = [('gmp', GMP_URL), ('mpfr', MPFR_URL), ('mpc', MPC_URL)]
+BUILD_SIZE_MB = 2048 # Estimated size of the build directory
+CONFIGURE_FLAGS = ['--disable-nls',
+                   '--enable-languages=c,c++',
+                   '--disable-multilib',
+                   '--without-headers']
 
 class Installer:
     '''Installer'''
@@ -45,13 +60,15 @@ class Installer:
     def __init__(self, defaultVer=DEFAULT_VER, defaultCodePrefixDir=None,
             defaultInstallPrefixDir=None, defaultForceInstall=None,
             defaultCrossDir=DEFAULT_CROSS_DIR, defaultTarget=None,
-            extraFlags=None):
-        '''See parseinstallargs for defaults prefixes'''
+            extraFlags=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         if extraFlags is None:
             extraFlags = ''
         self.extraFlags = extraFlags
         self.args = parseinstallargs.InstallArgs(APP, defaultVer, defaultCodePrefixDir,
-                defaultInstallPrefixDir, defaultForceInstall, defaultCrossDir, defaultTarget)
+                defaultInstallPrefixDir, defaultForceInstall, defaultCrossDir, defaultTarget,
+                values=values)
+        self.parseUnknownArgs()
 
     def parseUnknownArgs(self):
         #print('self.args.unknownArgs =', self.args.unknownArgs)
@@ -63,155 +80,148 @@ class Installer:
         (self.extraArgs, unknownArgs) = parser.parse_known_args(self.args.unknownArgs)
 
 
-    def runCmd(self, cmd, shell=True, verbose=False):
-        print('gcc_install.py: cwd={} cmd={}'.format(os.getcwd(), cmd))
-        if verbose:
-            output=None
-        else:
-            output=subprocess.DEVNULL
-        subprocess.run(cmd, shell=shell, stdout=output)
-
-    def makePrerequisiteLibrary(self, envVars, libSrcPath, installPrefixDir):
-        '''Makes a library using native gcc installing in installPrefixDir'''
-        print('makePrerequisiteLibrary:', libSrcPath)
-        cwd = os.getcwd()
-        os.chdir(libSrcPath)
-        self.runCmd('{} ./configure --prefix={}'.format(envVars, installPrefixDir))
-        self.runCmd('{} make -j {}'.format(envVars, multiprocessing.cpu_count()))
-        self.runCmd('{} make install'.format(envVars))
-        os.chdir(cwd)
-        print('makePrerequisiteLibrary: COMPLETED', libSrcPath)
+    def runCmd(self, cmd, step, env=None, verbose=False):
+        '''Run cmd, a list, logging its output as step, with verbose it's also on the console'''
+        print('gcc_install.py: cwd={} cmd={}'.format(os.getcwd(), ' '.join(cmd)))
+        buildlog.run(cmd, step, env=env, pass_fds=jobserver.fds(), echo=verbose)
+
+    def isInstalled(self):
+        return manifest.fromArgs(self.args).isInstalled(self.args.app, self.args.ver,
+                self.args.target, self.artifactKey())
+
+    def isCached(self):
+        '''True if the artifact cache has this build'''
+        cache = artifactcache.fromArgs(self.args)
+        return cache is not None and cache.contains(self.artifactKey())
 
     def install(self):
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        self.parseUnknownArgs()
-
-        try:
-            theApp = AN_APP
-            if self.args.target != '':
-                theApp = '{}-{}'.format(self.args.target, theApp)
-
-            theApp = os.path.join(dst_dir, theApp)
-            output = subprocess.check_output([theApp, '--version'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
+            cache = artifactcache.fromArgs(self.args)
+            key = self.artifactKey()
+            files = None if cache is None else cache.restore(key, self.args.installPrefixDir)
+            if files is not None:
+                manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                        self.args.installPrefixDir, self.args.target, key, files=files)
+                return 0
+
             code_dir = self.args.codePrefixDir
             if self.args.target != '':
                 code_dir = os.path.join(code_dir, self.args.target)
-            gmp_path = os.path.join(code_dir, 'gmp')
-            print('gcc_install: gmp_path=', gmp_path)
-            mpfr_path = os.path.join(code_dir, 'mpfr')
-            print('gcc_install: mpfr_path=', mpfr_path)
-            mpc_path = os.path.join(code_dir, 'mpc')
-            print('gcc_install: mpc_path=', mpc_path)
-            #isl does't compile and its optional so don't add
-            #isl_path = os.path.join(code_dir, 'isl')
-            #print('gcc_install: isl_path=', isl_path)
             gcc_path = os.path.join(code_dir, 'gcc')
             print('gcc_install: gcc_path=', gcc_path)
 
-            #envVars = ('LDFLAGS=-L/home/wink/opt/lib' +
-            #          ' CPPFLAGS=-I/home/wink/opt/include')
-            envVars = ''
-
-            # If desired make false when testing so we don't download.
-            if True:
-                if self.args.forceInstall:
-                    shutil.rmtree(gmp_path, ignore_errors=True)
-                    shutil.rmtree(mpfr_path, ignore_errors=True)
-                    shutil.rmtree(mpc_path, ignore_errors=True)
-                    #shutil.rmtree(isl_path, ignore_errors=True)
-                    shutil.rmtree(gcc_path, ignore_errors=True)
-
-                utils.wget_extract(GMP_URL, dst_path=gmp_path)
-                utils.wget_extract(MPFR_URL, dst_path=mpfr_path)
-                utils.wget_extract(MPC_URL, dst_path=mpc_path)
-                #utils.wget_extract(ISL_URL, dst_path=isl_path)
-                if True:
-                    # Use wget as its faster
-                    utils.wget_extract(GCC_URL.format(self.args.ver), dst_path=gcc_path)
-                    os.chdir(gcc_path)
-                else:
-                    # Use git, but its slower
-                    os.makedirs(self.args.codePrefixDir, exist_ok=True)
-                    utils.git('clone', [GCC_GIT_REPO_URL, gcc_path])
-                    os.chdir(gcc_path)
-                    utils.git('checkout', [CHECKOUT_LABEL])
-
-            # Make the prerequisites (isl is optional)
-            #self.makePrerequisiteLibrary(envVars, isl_path, os.path.dirname(self.args.installPrefixDir))
-
-            # Make the prerequisites (Not needed if I install existing versions??)
-            #self.makePrerequisiteLibrary(envVars, gmp_path, os.path.dirname(self.args.installPrefixDir))
-            #self.makePrerequisiteLibrary(envVars, mpfr_path, os.path.dirname(self.args.installPrefixDir))
-            #self.makePrerequisiteLibrary(envVars, mpc_path, os.path.dirname(self.args.installPrefixDir))
-
-            # Create the build directory and cd into it
-            os.chdir(gcc_path)
-            os.makedirs('build', exist_ok=True)
-            os.chdir('build')
-
-            # ls the directory with gcc, gmp, mpfr and mpc for debug purposes
-            #utils.bash('ls -al {}'.format(os.path.dirname(self.args.codePrefixDir)))
-
-            cmd = ('{env}' +
-                   ' ../configure --prefix={prefix}' +
-                   ' --with-gmp={gmp}' +
-                   ' --with-gmp-include={gmp}' +
-                   ' --with-mpfr={mpfr}' +
-                   ' --with-mpfr-include={mpfr}/src' +
-                   ' --with-mpc={mpc}' +
-                   ' --with-mpc-include={mpc}/src' +
-                   #' --with-isl={isl}' +
-                   #' --with-isl-include={isl}/include' +
-                   ' --disable-nls ' +
-                   ' --enable-languages=c,c++' +
-                   ' --disable-multilib' +
-                   ' --without-headers').format(
-                           env=envVars, prefix=self.args.installPrefixDir, gmp=gmp_path, mpfr=mpfr_path,
-                           mpc=mpc_path) #, isl=isl_path)
-            if self.args.target != '':
-                cmd += ' --target={}'.format(self.args.target)
-
-            # Add extraFlags added on the command line
-            for extraFlag in self.extraArgs.extraGccConfigFlags:
-                cmd += ' {}'.format(extraFlag)
-
-            # Add extraFlags passed to the constructor
-            for extraFlag in self.extraFlags:
-                cmd += ' {}'.format(extraFlag)
-            self.runCmd(cmd)
-
-            cpu_count = multiprocessing.cpu_count()
-            cci = os.environ.get('CIRCLECI')
-            if cci != None and cci == 'true':
-                cpu_count = 4;
-
-            self.runCmd('{env} make all-gcc -j {c}'
-                    .format(env=envVars, c=cpu_count), verbose=True)
-
-            self.runCmd('{env} make install-gcc'
-                    .format(env=envVars))
-
-            self.runCmd('{env} make all-target-libgcc -j {c}'
-                    .format(env=envVars, c=cpu_count))
-
-            self.runCmd('{env} make install-target-libgcc'
-                    .format(env=envVars))
+            #env = dict(os.environ, LDFLAGS='-L/home/wink/opt/lib',
+            #          CPPFLAGS='-I/home/wink/opt/include')
+            env = None
+
+            if self.args.forceInstall and not self.args.rebuild:
+                shutil.rmtree(gcc_path, ignore_errors=True)
+
+            # The prerequisites come from the shared store of host
+            # libraries, they're only built the first time they're needed
+            # on this host (isl does't compile and its optional so don't add).
+            # Their tarballs download in to the cache along with gcc's.
+            host_libs = hostlibs.fromArgs(self.args)
+            downloads = [host_libs.prefetchAsync(HOST_LIBS)]
+            gcc_url = GCC_URL.format(self.args.ver)
+            extract = not (self.args.rebuild and utils.extracted_from(gcc_path, gcc_url))
+            if not extract:
+                # Reuse the existing source, it's this version
+                print('gcc_install: rebuilding', gcc_path)
+            else:
+                shutil.rmtree(gcc_path, ignore_errors=True)
+                downloads.append(utils.wget_extract_async(gcc_url,
+                        dst_path=gcc_path, cache=downloadcache.fromArgs(self.args)))
+            utils.event_loop().run_until_complete(utils.gather_async(downloads))
+            if extract:
+                utils.mark_extracted(gcc_path, gcc_url)
+            libs = host_libs.ensure(HOST_LIBS)
+
+            # Build in gcc_path/build, or in RAM with --buildInRam
+            with rambuild.buildDir(self.args, os.path.join(gcc_path, 'build'),
+                    BUILD_SIZE_MB) as build_dir:
+                files = self.build(gcc_path, build_dir, libs, env)
+
+            if cache is not None:
+                cache.save(key, self.args.installPrefixDir, files)
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, self.args.target, key, files=files)
 
         return 0
 
+    def build(self, gcc_path, build_dir, libs, env=None):
+        '''Configure, make and install gcc_path in build_dir, env is
+        the environment of the commands or None to inherit this one.
+        Returns the paths installed, relative to the install prefix.'''
+        # Create the build directory and cd into it
+        os.makedirs(build_dir, exist_ok=True)
+        os.chdir(build_dir)
+
+        cmd = [os.path.join(gcc_path, 'configure'),
+               '--prefix={}'.format(self.args.installPrefixDir),
+               '--with-gmp={}'.format(libs['gmp']),
+               '--with-mpfr={}'.format(libs['mpfr']),
+               '--with-mpc={}'.format(libs['mpc'])]
+        cmd.extend(self.configureFlags())
+        # A rebuild reuses the existing configuration if it's the same
+        if not (self.args.rebuild and utils.configured_with(build_dir, cmd)):
+            with timing.span('configure'):
+                self.runCmd(cmd, 'configure', env)
+            utils.mark_configured(build_dir, cmd)
+
+        cpu_count = multiprocessing.cpu_count()
+        cci = os.environ.get('CIRCLECI')
+        if cci != None and cci == 'true':
+            cpu_count = 4;
+
+        with timing.span('make', target='all-gcc'):
+            self.runCmd(jobserver.makeCmd(['all-gcc'], cpu_count),
+                    'make-all-gcc', env)
+
+        # Both installs are staged then moved in to the prefix together
+        stage_dir = os.path.join(build_dir, 'stage')
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        destdir = 'DESTDIR={}'.format(stage_dir)
+
+        with timing.span('install', target='install-gcc'):
+            self.runCmd(['make', 'install-gcc', destdir], 'install-gcc', env)
+
+        with timing.span('make', target='all-target-libgcc'):
+            self.runCmd(jobserver.makeCmd(['all-target-libgcc'], cpu_count),
+                    'make-all-target-libgcc', env)
+
+        with timing.span('install', target='install-target-libgcc'):
+            self.runCmd(['make', 'install-target-libgcc', destdir], 'install-target-libgcc', env)
+            return utils.install_staged(stage_dir, self.args.installPrefixDir)
+
+    def configureFlags(self):
+        '''The configure flags other than the prefix and library paths'''
+        flags = list(CONFIGURE_FLAGS)
+        if self.args.target != '':
+            flags.append('--target={}'.format(self.args.target))
+
+        # Add extraFlags added on the command line
+        flags.extend(self.extraArgs.extraGccConfigFlags)
+
+        # Add extraFlags passed to the constructor
+        flags.extend(self.extraFlags)
+        return flags
+
+    def artifactKey(self):
+        '''The artifact cache key of this build, including the prefix
+        gcc is configured with as its paths are built in to it'''
+        return artifactcache.key(app=self.args.app, ver=self.args.ver,
+                target=self.args.target, configureFlags=self.configureFlags(),
+                prefix=self.args.installPrefixDir, crossDir=self.args.crossDir,
+                urls=[GCC_URL.format(self.args.ver), GMP_URL, MPFR_URL, MPC_URL])
+
 if __name__ == '__main__':
 
     if len(sys.argv) == 2 and sys.argv[1] == 'printVer':
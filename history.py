@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Per host history of how long installs take.
+#
+# After each run install.py records the wall and cpu time of every app
+# it built or restored, and of each of its phases, keyed by app,
+# version, target and cpus. The estimates are used to start the apps
+# on the longest path first and by --plan to predict a run.
+
+import utils
+import artifactcache
+
+import json
+import os
+import time
+
+HISTORY_WEIGHT = 0.5 # Weight of the latest run in the estimates
+
+# Rough build times in seconds on a 4 cpu host, for apps not yet in the history
+DEFAULT_ESTIMATES = {
+        'ninja': 60,
+        'meson': 30,
+        'ct-ng': 180,
+        'gcc-x86_64': 2400,
+        'gcc-i386': 2400,
+        'gcc-arm': 2400,
+        'qemu-system-arm': 900,
+        'binutils-arm-eabi': 600,
+        'binutils-i586-elf': 600,
+        'gcc-arm-eabi': 1500,
+        'gcc-i586-elf': 1500,
+}
+DEFAULT_CPUS = 4
+DEFAULT_RESTORE = 30
+
+def fromArgs(args):
+    '''The History of this host for InstallArgs args'''
+    return History(os.path.join(args.cacheDir, 'history',
+            '{}.json'.format(artifactcache.hostTriple())))
+
+def entryKey(app, ver, target, cpus):
+    return '{}|{}|{}|{}'.format(app, ver, target, cpus)
+
+class History:
+    '''Durations of previous installs on this host'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, runs):
+        '''Add runs, a list of dicts with the app, ver, target and cpus
+        of an install, its action, "build" or "restore", and the wall,
+        cpu and phases (name to wall) it took.
+        '''
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with utils.locked(self.path + '.lock'):
+            entries = self.load()
+            for run in runs:
+                key = entryKey(run['app'], run['ver'], run['target'], run['cpus'])
+                entry = entries.setdefault(key, {'app': run['app'], 'ver': run['ver'],
+                        'target': run['target'], 'cpus': run['cpus']})
+                old = entry.get(run['action'])
+                new = {'wall': run['wall'], 'cpu': run['cpu'], 'phases': dict(run['phases']),
+                        'runs': 1, 'last': time.time()}
+                if old is not None:
+                    new['wall'] = blend(old['wall'], run['wall'])
+                    new['cpu'] = blend(old['cpu'], run['cpu'])
+                    for name, wall in old['phases'].items():
+                        new['phases'][name] = blend(wall, run['phases'].get(name, wall))
+                    new['runs'] = old['runs'] + 1
+                entry[run['action']] = new
+            tmpPath = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmpPath, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, self.path)
+
+    def estimate(self, app, ver, target, cpus, action='build'):
+        '''The expected (wall, cpu) seconds of action for app and whether it
+        is from the history.
+
+        The best match in the history is the same version and cpus, then
+        the same cpus, then any, the wall time of a build with different
+        cpus is scaled by the cpus. Without history DEFAULT_ESTIMATES is used.
+        '''
+        candidates = [e for e in self.load().values()
+                if e['app'] == app and e['target'] == target and action in e]
+        if candidates:
+            best = max(candidates, key=lambda e: (e['cpus'] == cpus, e['ver'] == ver,
+                    e[action]['last']))
+            wall = best[action]['wall']
+            if action == 'build' and best['cpus'] != cpus:
+                wall = max(wall * best['cpus'] / cpus, best[action]['cpu'] / cpus)
+            return wall, best[action]['cpu'], True
+        if action == 'restore':
+            return DEFAULT_RESTORE, DEFAULT_RESTORE, False
+        seconds = DEFAULT_ESTIMATES.get(app, 600)
+        return seconds * DEFAULT_CPUS / max(cpus, 1), seconds * DEFAULT_CPUS, False
+
+def blend(old, new):
+    return old * (1 - HISTORY_WEIGHT) + new * HISTORY_WEIGHT
+
+def action(installer):
+    '''What installing would do: "skip", "restore" from the artifact cache or "build"'''
+    if not installer.args.forceInstall and installer.isInstalled():
+        return 'skip'
+    isCached = getattr(installer, 'isCached', None)
+    if isCached is not None and isCached():
+        return 'restore'
+    return 'build'
+
+def runs(installers, results, summary, cpus):
+    '''The runs to record from a summary, see timing.summary, of the
+    installers, a dict of app to installer, which succeeded in results'''
+    runs = []
+    for app, installer in installers.items():
+        s = summary.get(app)
+        if results.get(app) != 0 or s is None:
+            continue
+        runs.append({'app': app, 'ver': installer.args.ver, 'target': installer.args.target,
+                'cpus': cpus, 'action': 'restore' if 'restore' in s['phases'] else 'build',
+                'wall': s['wall'], 'cpu': s['user'] + s['sys'], 'phases': s['phases']})
+    return runs
+
+def formatSeconds(seconds):
+    if seconds < 60:
+        return '{:.0f}s'.format(seconds)
+    if seconds < 3600:
+        return '{:.0f}m{:02.0f}s'.format(seconds // 60, seconds % 60)
+    return '{:.0f}h{:02.0f}m'.format(seconds // 3600, seconds % 3600 // 60)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+import utils
+import jobserver
+import timing
+import buildlog
+import artifactcache
+import downloadcache
+
+import os
+import re
+import shutil
+
+COMPLETE_NAME = '.complete'
+
+def fromArgs(args):
+    '''The HostLibs store for InstallArgs args'''
+    return HostLibs(os.path.join(args.cacheDir, 'hostlibs', artifactcache.hostTriple()),
+            downloadcache.fromArgs(args))
+
+def libVersion(url):
+    '''The name and version of the library at url, e.g. gmp-6.0.0a'''
+    return re.sub(r'\.tar(\.[a-z0-9]+)?$', '', os.path.basename(url))
+
+class HostLibs:
+    '''Store of host companion libraries (gmp, mpfr, mpc ...).
+
+    Each version of a library is built once per host as a static
+    library in its own prefix under storeDir and then shared by
+    every toolchain that needs it.
+    '''
+
+    def __init__(self, storeDir, cache=None):
+        self.storeDir = storeDir
+        self.cache = cache
+        os.makedirs(self.storeDir, exist_ok=True)
+
+    def prefix(self, url):
+        return os.path.join(self.storeDir, libVersion(url))
+
+    def isBuilt(self, url):
+        return os.path.exists(os.path.join(self.prefix(url), COMPLETE_NAME))
+
+    async def prefetchAsync(self, libs):
+        '''Download the tarballs of the libraries in libs, a list of
+        (name, url), which aren't built yet in to the download cache
+        concurrently, so ensure doesn't wait for each in turn'''
+        if self.cache is None:
+            return
+        await utils.gather_async([self.cache.fetchAsync(url)
+                for name, url in libs if not self.isBuilt(url)])
+
+    def ensure(self, libs):
+        '''Build the missing libraries in libs, a list of (name, url).
+
+        Each library is configured with the ones before it in libs,
+        returns a dict of name to installed prefix.
+        '''
+        prefixes = {}
+        for name, url in libs:
+            self.build(name, url, prefixes)
+            prefixes[name] = self.prefix(url)
+        return prefixes
+
+    def build(self, name, url, deps):
+        '''Build name from url in to its prefix unless it's already there.
+
+        deps is a dict of the names and prefixes of libraries it needs.
+        '''
+        prefix = self.prefix(url)
+        with utils.locked(prefix + '.lock'):
+            if self.isBuilt(url):
+                print('hostlibs: using', prefix)
+                return
+            print('hostlibs: building', prefix)
+            build_dir = prefix + '.build'
+            shutil.rmtree(prefix, ignore_errors=True)
+            shutil.rmtree(build_dir, ignore_errors=True)
+            utils.wget_extract(url, dst_path=build_dir, cache=self.cache)
+            cmd = ['./configure', '--prefix={}'.format(prefix),
+                    '--disable-shared', '--enable-static', '--with-pic']
+            for dep, depPrefix in sorted(deps.items()):
+                cmd.append('--with-{}={}'.format(dep, depPrefix))
+            with timing.span('configure', lib=name):
+                buildlog.run(cmd, 'configure-{}'.format(name), cwd=build_dir)
+            with timing.span('make', lib=name):
+                buildlog.run(jobserver.makeCmd(), 'make-{}'.format(name),
+                        cwd=build_dir, pass_fds=jobserver.fds())
+            with timing.span('install', lib=name):
+                buildlog.run(['make', 'install'], 'install-{}'.format(name), cwd=build_dir)
+            shutil.rmtree(build_dir, ignore_errors=True)
+            open(os.path.join(prefix, COMPLETE_NAME), 'w').close()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Images of an install root, used by "install.py pack" and "deploy".
+#
+# An image is one file holding everything installed, so a new host is
+# provisioned by copying and unpacking one file instead of building or
+# copying many small ones. With mksquashfs installed it's a squashfs
+# image, which can be mounted read-only with squashfuse or unpacked with
+# unsquashfs. Otherwise it's a chunked image:
+#
+#   MAGIC, chunk 0, chunk 1, ... , index, footer
+#
+# Each chunk is an independently compressed posix tar of consecutive
+# files, so chunks unpack in parallel and a few files can be unpacked
+# by reading only their chunks. Directories come first, as entries of
+# their own, so empty ones are kept as they are in squashfs. The index is zlib compressed json
+# listing each chunk's offset, size, sha256 and files. The footer is
+# the index's offset and size followed by MAGIC. posix tars keep the
+# nanosecond mtimes the install manifest checks, so deployed apps are
+# seen as installed.
+
+import utils
+import artifactcache
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import stat
+import struct
+import subprocess
+import tempfile
+import time
+import zlib
+
+MAGIC = b'VITIMG01'
+SQUASHFS_MAGIC = b'hsqs'
+FOOTER = struct.Struct('<QQ8s')
+CHUNK_SIZE = 64 * 1024 * 1024 # Uncompressed bytes, at most
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+def defaultPath(args):
+    '''The image path for InstallArgs args, --image or one per host in <cacheDir>/images'''
+    if args.image is not None:
+        return args.image
+    return os.path.join(args.cacheDir, 'images',
+            'tools-{}.img'.format(artifactcache.hostTriple()))
+
+def formatOf(path):
+    '''"squashfs" or "chunked" from the leading bytes of the image at path'''
+    with open(path, 'rb') as f:
+        header = f.read(len(MAGIC))
+    if header.startswith(SQUASHFS_MAGIC):
+        return 'squashfs'
+    if header == MAGIC:
+        return 'chunked'
+    raise ValueError('image: {} is not an image'.format(path))
+
+def entries(root):
+    '''The paths relative to root of the directories and files under it,
+    the directories first. A symlink to a directory is a file.'''
+    dirs = []
+    for dirpath, dirnames, _ in os.walk(root):
+        dirs += [os.path.relpath(os.path.join(dirpath, name), root) for name in dirnames
+                if not os.path.islink(os.path.join(dirpath, name))]
+    return dirs + utils.files_changed_since(root)
+
+def entrySize(path):
+    '''The bytes of the entry at path in a tar, nothing for a directory'''
+    st = os.lstat(path)
+    return 0 if stat.S_ISDIR(st.st_mode) else st.st_size
+
+def chunks(root, files, chunkSize):
+    '''Split files, relative to root, in to consecutive lists of at most
+    chunkSize bytes, a larger file is a chunk by itself'''
+    result = [[]]
+    size = 0
+    for name in files:
+        n = entrySize(os.path.join(root, name))
+        if result[-1] and size + n > chunkSize:
+            result.append([])
+            size = 0
+        result[-1].append(name)
+        size += n
+    return [c for c in result if c]
+
+async def compressionOption():
+    '''The tar option chunks are compressed with, zstd if tar and zstd have it'''
+    if shutil.which('zstd') and '--zstd' in await utils.output_async(['tar', '--help']):
+        return '--zstd'
+    return '--gzip'
+
+async def packChunk(root, names, chunkPath, option, semaphore):
+    async with semaphore:
+        listPath = chunkPath + '.list'
+        with open(listPath, 'w') as f:
+            f.write('\0'.join(names))
+        try:
+            await utils.run_async(['tar', '-c', option, '--format=posix', '-f', chunkPath,
+                    '-C', root, '--null', '--no-recursion', '-T', listPath])
+        finally:
+            os.remove(listPath)
+
+async def packChunkedAsync(root, path, cpus):
+    files = entries(root)
+    total = sum(entrySize(os.path.join(root, name)) for name in files)
+    # Enough chunks to keep every cpu busy when unpacking
+    chunkSize = max(MIN_CHUNK_SIZE, min(CHUNK_SIZE, total // max(cpus, 1) + 1))
+    groups = chunks(root, files, chunkSize)
+    option = await compressionOption()
+    workDir = tempfile.mkdtemp(prefix='image-', dir=os.path.dirname(path))
+    tmpPath = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        chunkPaths = [os.path.join(workDir, '{:05d}.tar'.format(i)) for i in range(len(groups))]
+        semaphore = asyncio.Semaphore(max(cpus, 1))
+        await utils.gather_async([packChunk(root, names, chunkPath, option, semaphore)
+                for names, chunkPath in zip(groups, chunkPaths)])
+        index = {'version': 1, 'compression': option, 'host': artifactcache.hostTriple(),
+                'created': time.time(), 'bytes': total, 'chunks': []}
+        with open(tmpPath, 'wb') as out:
+            out.write(MAGIC)
+            for names, chunkPath in zip(groups, chunkPaths):
+                h = hashlib.sha256()
+                offset = out.tell()
+                with open(chunkPath, 'rb') as f:
+                    for block in iter(lambda: f.read(READ_SIZE), b''):
+                        h.update(block)
+                        out.write(block)
+                os.remove(chunkPath)
+                index['chunks'].append({'offset': offset, 'size': out.tell() - offset,
+                        'sha256': h.hexdigest(), 'files': names})
+            data = zlib.compress(json.dumps(index).encode('utf-8'))
+            offset = out.tell()
+            out.write(data)
+            out.write(FOOTER.pack(offset, len(data), MAGIC))
+        os.replace(tmpPath, path)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+    return len(files), len(groups)
+
+def pack(root, path, imageFormat='auto', cpus=1):
+    '''Pack everything under root in to an image at path, see the top of
+    this file for the formats, returns the image's format'''
+    if imageFormat == 'auto':
+        imageFormat = 'squashfs' if shutil.which('mksquashfs') else 'chunked'
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    startTime = time.monotonic()
+    if imageFormat == 'squashfs':
+        tmpPath = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            utils.run(['mksquashfs', root, tmpPath, '-noappend', '-comp', 'xz',
+                    '-processors', str(max(cpus, 1))], stdout=subprocess.DEVNULL)
+            os.replace(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        print('image: packed {} as squashfs {}'.format(root, path))
+    else:
+        files, count = utils.event_loop().run_until_complete(packChunkedAsync(root, path, cpus))
+        print('image: packed {} entries from {} in {} chunks as {}'.format(files, root, count, path))
+    printThroughput('packed', os.path.getsize(path), time.monotonic() - startTime)
+    return imageFormat
+
+def readIndex(path):
+    '''The index of the chunked image at path'''
+    with open(path, 'rb') as f:
+        f.seek(-FOOTER.size, os.SEEK_END)
+        offset, size, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError('image: {} has no index'.format(path))
+        f.seek(offset)
+        return json.loads(zlib.decompress(f.read(size)).decode('utf-8'))
+
+def selected(names, paths):
+    '''The names which are one of paths or under one, all of them if paths is empty'''
+    if not paths:
+        return list(names)
+    prefixes = [p.strip('/') for p in paths]
+    return [n for n in names if any(n == p or n.startswith(p + '/') for p in prefixes)]
+
+async def deployChunk(path, chunk, dst, members, semaphore):
+    '''Unpack members, or all files if None, of chunk in to dst, the
+    chunk is read from the image and piped to tar'''
+    async with semaphore:
+        tar = None
+        listPath = None
+        try:
+            with open(path, 'rb') as f:
+                f.seek(chunk['offset'])
+                remaining = chunk['size']
+                block = f.read(min(READ_SIZE, remaining))
+                option, _ = await utils.decompress_option_async(block)
+                cmd = ['tar', '-x'] + option + ['-C', dst]
+                if members is not None:
+                    fd, listPath = tempfile.mkstemp(dir=dst, prefix='.image-', suffix='.list')
+                    with os.fdopen(fd, 'w') as listFile:
+                        listFile.write('\0'.join(members))
+                    # members lists what's under a directory, only the
+                    # directory's own entry is wanted
+                    cmd += ['--null', '--no-recursion', '-T', listPath]
+                tar = await utils.start_async(cmd, stdin=subprocess.PIPE)
+                h = hashlib.sha256()
+                while block:
+                    h.update(block)
+                    remaining -= len(block)
+                    tar.stdin.write(block)
+                    await tar.stdin.drain()
+                    block = f.read(min(READ_SIZE, remaining))
+            tar.stdin.close()
+            await utils.wait_async(tar, cmd)
+            if h.hexdigest() != chunk['sha256']:
+                raise ValueError('image: {} chunk at {} is corrupt'.format(path, chunk['offset']))
+        except BaseException:
+            if tar is not None and tar.returncode is None:
+                await utils.kill_async(tar)
+            raise
+        finally:
+            if listPath is not None:
+                os.remove(listPath)
+
+def deploy(path, dst, paths=None, cpus=1):
+    '''Unpack the image at path in to dst, only paths and what's under
+    them if supplied. Raises KeyError with a path the image hasn't got.
+    '''
+    os.makedirs(dst, exist_ok=True)
+    startTime = time.monotonic()
+    if formatOf(path) == 'squashfs':
+        utils.run(['unsquashfs', '-f', '-d', dst, '-p', str(max(cpus, 1)), path] + list(paths or []),
+                stdout=subprocess.DEVNULL)
+        nbytes = os.path.getsize(path)
+    else:
+        index = readIndex(path)
+        for p in paths or []:
+            if not any(selected(c['files'], [p]) for c in index['chunks']):
+                raise KeyError(p)
+        work = []
+        for chunk in index['chunks']:
+            members = selected(chunk['files'], paths)
+            if members:
+                work.append((chunk, None if not paths else members))
+        semaphore = asyncio.Semaphore(max(cpus, 1))
+        utils.event_loop().run_until_complete(utils.gather_async(
+                [deployChunk(path, chunk, dst, members, semaphore) for chunk, members in work]))
+        nbytes = sum(chunk['size'] for chunk, _ in work)
+        print('image: deployed {} of {} chunks from {} to {}'
+                .format(len(work), len(index['chunks']), path, dst))
+    printThroughput('deployed', nbytes, time.monotonic() - startTime)
+
+def mount(path, mountPoint):
+    '''Mount the squashfs image at path read-only at mountPoint with
+    squashfuse. mountPoint must be empty or not exist, so nothing is
+    hidden under the mount.'''
+    if os.path.isdir(mountPoint) and os.listdir(mountPoint):
+        raise ValueError('image: {} is not empty, mount at an empty directory'.format(mountPoint))
+    if os.path.exists(mountPoint) and not os.path.isdir(mountPoint):
+        raise ValueError('image: {} is not a directory'.format(mountPoint))
+    if formatOf(path) != 'squashfs':
+        raise ValueError('image: only squashfs images can be mounted, {} is chunked'.format(path))
+    if shutil.which('squashfuse') is None:
+        raise FileNotFoundError('image: squashfuse is needed to mount {}'.format(path))
+    os.makedirs(mountPoint, exist_ok=True)
+    utils.run(['squashfuse', path, mountPoint])
+    print('image: mounted {} at {}, unmount with: fusermount -u {}'.format(path, mountPoint, mountPoint))
+
+def printThroughput(what, nbytes, seconds):
+    print('image: {} {:.1f}MB in {:.2f}s, {:.1f}MB/s'.format(what, nbytes / (1024 * 1024),
+            seconds, nbytes / (1024 * 1024) / max(seconds, 1e-6)))
+
+def main(args, command, paths):
+    '''Run command, "pack" or "deploy" paths, for InstallArgs args,
+    returns the exit code'''
+    path = defaultPath(args)
+    try:
+        if command == 'pack':
+            if paths:
+                print('image: pack takes no paths, it packs all of', args.installRootDir)
+                return 1
+            pack(args.installRootDir, path, args.imageFormat, args.cpus)
+        elif args.mount is not None:
+            if paths:
+                print('image: --mount mounts the whole image, paths are not allowed')
+                return 1
+            mount(path, args.mount)
+        else:
+            deploy(path, args.installRootDir, paths, args.cpus)
+    except KeyError as e:
+        print('image: {} is not in {}'.format(e.args[0], path))
+        return 1
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        print(e)
+        return 1
+    return 0
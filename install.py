@@ -17,74 +17,157 @@
 # Install all or a specific set of the vendor tools
 
 import parseinstallargs
-import ninja_install
-import meson_install
-import crosstool_ng_install
-import ct_ng_runner
-import binutils_install
-import gcc_install
-import qemu_install
-
-import argparse
-import sys
-import os
-import subprocess
-import argparse
+import apps
 
-all_apps = ['ninja', 'meson',
-        #'binutils-i586-elf', 'binutils-arm-eabi',
-        #'gcc-i586-elf', 'gcc-arm-eabi',
-        'ct-ng',
-        'gcc-x86_64', 'gcc-i386', 'gcc-arm',
-        'qemu-system-arm']
+import sys
 
-args = parseinstallargs.InstallArgs('all', apps=all_apps)
+args = parseinstallargs.InstallArgs('all', apps=apps.ALL)
 
 if len(args.apps) == 0:
     args.print_help()
     sys.exit(0)
 
+# "verify [app or binary ...]" checks what's installed, by default apps.ALL
+if len(args.apps) != 0 and args.apps[0] == 'verify':
+    import verify
+    names = args.apps[1:]
+    if len(names) == 0 or 'all' in names:
+        names = apps.ALL + [name for name in names if name != 'all']
+    sys.exit(verify.main(args, names))
+
+# "pack" packs the install root in to one image, "deploy [path ...]"
+# unpacks it, or only paths, in to the install root or mounts it
+if len(args.apps) != 0 and args.apps[0] in ('pack', 'deploy'):
+    import image
+    sys.exit(image.main(args, args.apps[0], args.apps[1:]))
+
 if 'all' in args.apps:
-    args.apps = all_apps
+    args.apps = apps.ALL
 
-cwd = os.getcwd();
-# Install the apps
 for app in args.apps:
-    # Start in the current directory
-    os.chdir(cwd)
-    if app == 'ninja':
-        installer = ninja_install.Installer()
-        installer.install()
-    elif app == 'meson':
-        installer = meson_install.Installer()
-        installer.install()
-    elif app == 'ct-ng':
-        installer = crosstool_ng_install.Installer()
-        installer.install()
-    elif app == 'binutils-arm-eabi':
-        installer = binutils_install.Installer(defaultTarget='arm-eabi')
-        installer.install()
-    elif app == 'binutils-i586-elf':
-        installer = binutils_install.Installer(defaultTarget='i586-elf')
-        installer.install()
-    elif app == 'gcc-arm-eabi':
-        installer = gcc_install.Installer(defaultTarget='arm-eabi')
-        installer.install()
-    elif app == 'gcc-i586-elf':
-        installer = gcc_install.Installer(defaultTarget='i586-elf')
-        installer.install()
-    elif app == 'gcc-x86_64':
-        builder = ct_ng_runner.Builder(defaultTarget='x86_64-unknown-elf')
-        builder.build()
-    elif app == 'gcc-i386':
-        builder = ct_ng_runner.Builder(defaultTarget='i386-unknown-elf')
-        builder.build()
-    elif app == 'gcc-arm':
-        builder = ct_ng_runner.Builder(defaultTarget='arm-unknown-eabi')
-        builder.build()
-    elif app == 'qemu-system-arm':
-        installer = qemu_install.Installer()
-        installer.install()
-    else:
+    if app not in apps.ALL and app not in apps.OTHER:
         print('Unknown app:', app)
         sys.exit(1)
+
+# An app installed by an earlier run with the same fingerprint is
+# skipped from the manifest alone, see apps.fingerprint, so a run with
+# nothing to do imports no installer.
+import manifest
+
+installed = manifest.fromArgs(args)
+fingerprints = {}
+todo = []
+for app in args.apps:
+    fingerprints[app] = apps.fingerprint(app, args)
+    if not args.forceInstall and apps.isInstalled(app, args, installed):
+        print('{} is already installed'.format(app))
+    else:
+        todo.append(app)
+
+if len(todo) == 0 and not args.plan:
+    sys.exit(0)
+
+# Only installs need the rest, help and verify don't import it
+import scheduler
+import jobserver
+import timing
+import buildlog
+import ccache
+import history
+
+import shutil
+import tempfile
+
+# Check the install manifest in this process and only schedule the apps
+# which aren't already installed. Only their installers are created.
+installers = {}
+actions = dict((app, 'skip') for app in args.apps)
+for app in todo:
+    installers[app] = apps.create(app)
+    actions[app] = history.action(installers[app])
+    if actions[app] == 'skip':
+        print('{} is already installed'.format(app))
+        installed.setFingerprint(apps.entryName(app, args), fingerprints[app])
+        del installers[app]
+pending = [app for app in args.apps if app in installers]
+
+# The expected duration of each app from the history of this host
+hist = history.fromArgs(args)
+estimates = {}
+for app in pending:
+    estimates[app] = hist.estimate(app, installers[app].args.ver,
+            installers[app].args.target, args.cpus, actions[app])
+
+def schedule(tasks):
+    '''A scheduler of apps with tasks, a dict of app to the function installing it'''
+    sched = scheduler.Scheduler(jobs=args.jobs)
+    for app in pending:
+        sched.add(app, tasks.get(app), apps.get(app).deps, cost=estimates[app][0])
+    return sched
+
+if args.plan:
+    finish, times = schedule({}).simulate()
+    cpu = sum(estimates[app][1] for app in pending)
+    # The apps share args.cpus so they can't all finish sooner than this
+    finish = max(finish, cpu / args.cpus)
+    print('{:<20} {:<8} {:>10} {:>10} {}'.format('app', 'action', 'start', 'estimate', 'from'))
+    for app in args.apps:
+        if actions[app] == 'skip':
+            print('{:<20} {:<8}'.format(app, 'skip'))
+            continue
+        wall, _, known = estimates[app]
+        print('{:<20} {:<8} {:>10} {:>10} {}'.format(app, actions[app],
+                history.formatSeconds(times[app][0]), history.formatSeconds(wall),
+                'history' if known else 'default'))
+    print('Estimated wall time {} with {} cpus'.format(history.formatSeconds(finish), args.cpus))
+    sys.exit(0)
+
+if len(pending) == 0:
+    sys.exit(0)
+
+# One jobserver shared by every make so the apps installing
+# concurrently don't use more than args.cpus jobs in total.
+jobserver.start(args.cpus)
+
+# Optionally compile everything through one shared ccache
+cc = ccache.fromArgs(args)
+if cc is not None:
+    cc.enable()
+    ccacheStats = cc.stats()
+
+def install_app(app):
+    '''Install app timing it as a whole and by phase'''
+    timing.setApp(app)
+    with timing.span(app) as record:
+        record['retval'] = installers[app].install()
+    return record['retval']
+
+# Every process records its timing spans in timingDir,
+# they're merged in to the report once all are done.
+timingDir = tempfile.mkdtemp(prefix='install-timing-')
+timing.start(timingDir)
+buildlog.start(args.logDir)
+
+# Install the apps, each starts in the current directory as it runs in
+# a process forked from this one. Those on the longest path start first.
+sched = schedule(dict((app, lambda app=app: install_app(app)) for app in pending))
+results = {}
+try:
+    results = sched.run()
+finally:
+    timing.writeReport(timingDir, args.report)
+    hist.record(history.runs(installers, results,
+            timing.summary(timing.loadSpans(timingDir)), args.cpus))
+    if cc is not None:
+        cc.report(ccacheStats)
+    print('Build logs are in', args.logDir)
+    shutil.rmtree(timingDir, ignore_errors=True)
+
+for app in pending:
+    if results[app] == 0:
+        installed.setFingerprint(apps.entryName(app, args), fingerprints[app])
+
+failed = [app for app in pending if results[app] != 0]
+if len(failed) != 0:
+    print('Failed to install:', failed)
+    sys.exit(1)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# A GNU make jobserver shared by every build started by install.py.
+#
+# install.py calls start() once, the pipe and MAKEFLAGS are then
+# inherited by every installer process and make they run, so the
+# total number of compile jobs never exceeds the cpu budget. Each
+# process implicitly owns one job, the pipe holds a token for each
+# of the remaining jobs. Tools which don't speak the jobserver
+# protocol (ct-ng, ninja) lease tokens for the duration of their run.
+
+import atexit
+import contextlib
+import fcntl
+import multiprocessing
+import os
+import re
+import select
+import subprocess
+import tempfile
+import time
+
+ENV_NAME = 'INSTALL_JOBSERVER'
+TOKEN = b'+'
+LEASE_WAIT = 60 # Seconds to wait for tokens before leasing fewer
+
+_nonblockingFd = None
+
+def start(cpus):
+    '''Start a jobserver with cpus jobs and export it to child processes'''
+    r, w = os.pipe()
+    os.write(w, TOKEN * (cpus - 1))
+    fd, lockPath = tempfile.mkstemp(prefix='jobserver-', suffix='.lock')
+    os.close(fd)
+    atexit.register(os.remove, lockPath)
+    os.environ[ENV_NAME] = '{},{},{},{}'.format(r, w, cpus, lockPath)
+    os.environ['MAKEFLAGS'] = ' -j {}'.format(_authOption(r, w))
+    print('jobserver: started with {} jobs'.format(cpus))
+
+def _authOption(r, w):
+    # make 4.2 renamed --jobserver-fds to --jobserver-auth
+    try:
+        output = subprocess.check_output(['make', '--version'],
+                universal_newlines=True)
+        m = re.search(r'GNU Make (\d+)\.(\d+)', output)
+        if m and (int(m.group(1)), int(m.group(2))) >= (4, 2):
+            return '--jobserver-auth={},{}'.format(r, w)
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return '--jobserver-fds={},{}'.format(r, w)
+
+def _env():
+    value = os.environ.get(ENV_NAME)
+    if not value:
+        return None
+    r, w, cpus, lockPath = value.split(',', 3)
+    return int(r), int(w), int(cpus), lockPath
+
+def active():
+    '''True if a jobserver is available to this process'''
+    return _env() is not None
+
+def budget():
+    '''The total number of jobs available'''
+    env = _env()
+    if env is None:
+        return multiprocessing.cpu_count()
+    return env[2]
+
+def fds():
+    '''The file descriptors children must inherit, use as pass_fds'''
+    env = _env()
+    if env is None:
+        return ()
+    return env[:2]
+
+def makeJobs(jobs=None):
+    '''The -j arguments for make, none when make should use the jobserver'''
+    if active():
+        return []
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    return ['-j', str(jobs)]
+
+def makeCmd(targets=(), jobs=None):
+    '''The argument list running make for targets with jobs, see makeJobs'''
+    return ['make'] + list(targets) + makeJobs(jobs)
+
+def readFd():
+    '''A non-blocking file descriptor for reading tokens.
+
+    The pipe is opened again so O_NONBLOCK doesn't affect the
+    file description shared with make.
+    '''
+    global _nonblockingFd
+    if _nonblockingFd is None:
+        _nonblockingFd = os.open('/proc/self/fd/{}'.format(_env()[0]),
+                os.O_RDONLY | os.O_NONBLOCK)
+    return _nonblockingFd
+
+def tryAcquire():
+    '''Take a token without blocking, returns None if none is available'''
+    try:
+        token = os.read(readFd(), 1)
+    except BlockingIOError:
+        return None
+    return token if token else None
+
+def release(token):
+    '''Return a token taken by tryAcquire'''
+    os.write(_env()[1], token)
+
+@contextlib.contextmanager
+def lease(wanted):
+    '''Hold tokens for up to wanted jobs, including the one this process owns.
+
+    Yields the number of jobs the caller may run. Leases are taken one
+    at a time and a lease settles for fewer jobs after LEASE_WAIT seconds,
+    so two leases can't deadlock waiting for each others tokens. Without
+    a jobserver the caller gets all it wanted.
+    '''
+    if not active():
+        yield wanted
+        return
+    wanted = max(1, min(wanted, budget()))
+    tokens = []
+    try:
+        with open(_env()[3]) as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            deadline = time.monotonic() + LEASE_WAIT
+            while len(tokens) < wanted - 1:
+                token = tryAcquire()
+                if token is not None:
+                    tokens.append(token)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                select.select([readFd()], [], [], remaining)
+        print('jobserver: leased {} of {} jobs'.format(len(tokens) + 1, wanted))
+        yield len(tokens) + 1
+    finally:
+        for token in tokens:
+            release(token)
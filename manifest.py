@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+import json
+import os
+import time
+
+MANIFEST_NAME = '.install-manifest.json'
+
+def fromArgs(args):
+    '''The Manifest of the install prefix in InstallArgs args'''
+    return Manifest(args.installRootDir)
+
+class Manifest:
+    '''Record of what is installed under an install prefix.
+
+    Each entry holds the version, target and config hash of an app
+    along with the size and mtime of every file it installed, so
+    checking an app is installed only needs to stat its files.
+    '''
+
+    def __init__(self, rootDir):
+        self.rootDir = rootDir
+        self.path = os.path.join(rootDir, MANIFEST_NAME)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def entryName(self, name, target=''):
+        if not target or name.startswith(target + '-'):
+            return name
+        return '{}-{}'.format(target, name)
+
+    def lookup(self, name, target=''):
+        '''The entry for name and target or None'''
+        return self.load().get(self.entryName(name, target))
+
+    def isInstalled(self, name, ver, target='', configHash=None):
+        '''True if ver of name is installed and its files are unchanged'''
+        entry = self.lookup(name, target)
+        if entry is None or entry['ver'] != ver:
+            return False
+        if configHash is not None and entry['configHash'] != configHash:
+            return False
+        for path, (mtime, size) in entry['files'].items():
+            try:
+                st = os.lstat(os.path.join(self.rootDir, path))
+            except OSError:
+                return False
+            if st.st_mtime_ns != mtime or st.st_size != size:
+                return False
+        return True
+
+    def record(self, name, ver, prefix, target='', configHash=None, files=None, source=None):
+        '''Record name as installed with files, paths relative to prefix,
+        or if None every file in prefix, which must then be name's alone.
+        source optionally names the exact source built, e.g. a git commit.'''
+        # Only recording needs utils, install.py checks without importing it
+        import utils
+        if files is None:
+            files = utils.files_changed_since(prefix)
+        paths = files
+        files = {}
+        for path in paths:
+            path = os.path.join(prefix, path)
+            st = os.lstat(path)
+            files[os.path.relpath(path, self.rootDir)] = [st.st_mtime_ns, st.st_size]
+        os.makedirs(self.rootDir, exist_ok=True)
+        with utils.locked(self.path + '.lock'):
+            entries = self.load()
+            entries[self.entryName(name, target)] = {
+                    'ver': ver,
+                    'target': target,
+                    'configHash': configHash,
+                    'source': source,
+                    'installed': time.time(),
+                    'files': files,
+            }
+            tmpPath = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmpPath, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, self.path)
+        print('manifest: recorded {} {} with {} files'.format(
+                self.entryName(name, target), ver, len(files)))
+
+    def setFingerprint(self, name, fingerprint, target=''):
+        '''Store fingerprint, see apps.fingerprint, in the entry for name and target'''
+        import utils
+        with utils.locked(self.path + '.lock'):
+            entries = self.load()
+            entry = entries.get(self.entryName(name, target))
+            if entry is None:
+                return
+            entry['fingerprint'] = fingerprint
+            tmpPath = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmpPath, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, self.path)
@@ -16,11 +16,15 @@
 
 import utils
 import parseinstallargs
+import manifest
+import timing
+import buildlog
 
 import glob
 import subprocess
 import sys
 import os
+import time
 import traceback
 import shutil
 
@@ -40,41 +44,41 @@ class Installer:
     '''Installer for meson.'''
 
     def __init__(self, defaultVer=DEFAULT_VER, defaultCodePrefixDir=None,
-            defaultInstallPrefixDir=None, defaultForceInstall=None):
-        '''See parseinstallargs for defaults prefixes'''
+            defaultInstallPrefixDir=None, defaultForceInstall=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         self.args = parseinstallargs.InstallArgs(APP, defaultVer, defaultCodePrefixDir,
-                defaultInstallPrefixDir, defaultForceInstall)
+                defaultInstallPrefixDir, defaultForceInstall, values=values)
+
+    def isInstalled(self):
+        return manifest.fromArgs(self.args).isInstalled(self.args.app, self.args.ver)
 
     def install(self):
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        try:
-            dst = os.path.join(dst_dir, self.args.app)
-            output = subprocess.check_output([dst, '-v'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
             # If there is a previous version uninstall it
-            if len(output) > 0:
+            if manifest.fromArgs(self.args).lookup(self.args.app) is not None:
                 # Uninstall any existing version
                 print('uninstalling {app}'.format(app=self.args.app))
-                subprocess.check_call('pip3 uninstall -y {app}'.format(app=self.args.app), shell=True)
+                utils.run(['pip3', 'uninstall', '-y', self.args.app])
             else:
                 print('{app} is not installed'.format(app=self.args.app))
 
             # Install using pip3
             print('installing {app} {ver}'.format(app=self.args.app, ver=self.args.ver))
-            subprocess.check_call('pip3 install --prefix {prefix} --upgrade {app}=={ver}'
-                .format(prefix=self.args.installPrefixDir, app=self.args.app, ver=self.args.ver), shell=True)
+            # Staged under --root so exactly meson's files are recorded
+            stage_dir = os.path.join(self.args.codePrefixDir, self.args.app, 'stage')
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            with timing.span('install'):
+                buildlog.run(['pip3', 'install', '--root', stage_dir,
+                    '--prefix', self.args.installPrefixDir, '--upgrade',
+                    '{app}=={ver}'.format(app=self.args.app, ver=self.args.ver)], 'pip3-install')
+                files = utils.install_staged(stage_dir, self.args.installPrefixDir)
 
             # Be sure we have the "bin" versions (i.e. the version without trailing .py)
             meson_script = os.path.join(self.args.installPrefixDir,'bin/meson.py')
@@ -101,6 +105,14 @@ class Installer:
                 os.symlink(wraptool_script, wraptool_bin)
             else:
                 print('No symlinks are needed')
+            # The symlinks are meson's too, whether made now or before
+            for path in [meson_bin, mesonconf_bin, mesonintrospect_bin, wraptool_bin]:
+                name = os.path.relpath(path, self.args.installPrefixDir)
+                if os.path.islink(path) and name not in files:
+                    files.append(name)
+
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, files=files)
 
             # Tell the user to update PYTHONPATH
             python_path = glob.glob(os.path.join(self.args.installPrefixDir, 'lib/python*'))
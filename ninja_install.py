@@ -16,10 +16,14 @@
 
 import utils
 import parseinstallargs
+import manifest
+import timing
+import buildlog
 
 import subprocess
 import sys
 import os
+import time
 import traceback
 import shutil
 
@@ -31,45 +35,47 @@ class Installer:
     '''Installer for ninja.'''
 
     def __init__(self, defaultVer=DEFAULT_VER, defaultCodePrefixDir=None,
-            defaultInstallPrefixDir=None, defaultForceInstall=None):
-        '''See parseinstallargs for defaults prefixes'''
+            defaultInstallPrefixDir=None, defaultForceInstall=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         self.args = parseinstallargs.InstallArgs(APP, defaultVer, defaultCodePrefixDir,
-                defaultInstallPrefixDir, defaultForceInstall)
+                defaultInstallPrefixDir, defaultForceInstall, values=values)
+
+    def isInstalled(self):
+        return manifest.fromArgs(self.args).isInstalled(self.args.app, self.args.ver)
 
     def install(self):
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        try:
-            dst = os.path.join(dst_dir, self.args.app)
-            output = subprocess.check_output([dst, '--version'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
             print('compiling {app} {ver}'
                     .format(app=self.args.app, ver=self.args.ver))
             code_dir = os.path.join(self.args.codePrefixDir, self.args.app)
-            if self.args.forceInstall:
+            if self.args.forceInstall and not self.args.rebuild:
                 shutil.rmtree(code_dir, ignore_errors=True)
-            os.makedirs(code_dir)
+            os.makedirs(code_dir, exist_ok=self.args.rebuild)
 
-            utils.git('clone', [URL, code_dir])
+            utils.git_checkout(URL, code_dir, 'v{}'.format(self.args.ver),
+                    utils.git_mirror_dir(self.args), self.args.shallow,
+                    update=self.args.rebuild)
             os.chdir(code_dir)
-            utils.git('checkout', ['v{}'.format(self.args.ver)])
 
-            subprocess.check_call(['./configure.py', '--bootstrap'])
+            # The bootstrap can't be given a job count, its ninja step
+            # always runs its default number of jobs, so it takes no lease
+            # from the jobserver. It's a few dozen small files.
+            with timing.span('make'):
+                buildlog.run(['./configure.py', '--bootstrap'], 'bootstrap')
             dst = os.path.join(self.args.installPrefixDir, 'bin')
             os.makedirs(dst, exist_ok=True)
             dst = os.path.join(dst, self.args.app)
-            shutil.copy2('./{}'.format(self.args.app), dst)
+            with timing.span('install'):
+                shutil.copy2('./{}'.format(self.args.app), dst)
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, files=[os.path.join('bin', self.args.app)])
 
         return retval
 
@@ -15,16 +15,29 @@
 # limitations under the license.
 
 import argparse
+import multiprocessing
 import os
+import time
 
 DEFAULT_CODE_PREFIX_DIR = '~/tmp'
 DEFAULT_INSTALL_PREFIX_DIR = '~/opt'
+DEFAULT_CACHE_DIR = '~/.cache/vendor-install-tools'
+DEFAULT_DOWNLOAD_CACHE_SIZE = 2048 # MB
 
 class InstallArgs(argparse.ArgumentParser):
+    '''The options of an install of app.
+
+    They're parsed from argv, by default sys.argv. If values, a dict of
+    option name to value, is supplied the options are the defaults
+    updated with values and the command line isn't looked at, so
+    installs can be driven from other code. Raises ValueError if values
+    has a name which isn't an option.
+    '''
+
     def __init__(self, app, defaultVer=None, defaultCodePrefixDir=None,
             defaultInstallPrefixDir=None, defaultForceInstall=None,
             defaultCrossDir=None, defaultTarget=None, defaultGitVer=None,
-            apps=None):
+            apps=None, argv=None, values=None):
         parser = argparse.ArgumentParser()
 
         self.app = app
@@ -87,19 +100,145 @@ class InstallArgs(argparse.ArgumentParser):
                 nargs='?',
                 default=defaultTarget);
 
+        parser.add_argument('--jobs',
+                help='Maximum number of apps to install concurrently, 0 is no limit (default: 0)',
+                type=int,
+                default=0)
+
+        parser.add_argument('--cpus',
+                help='Total compile jobs shared by all apps (default: {})'
+                        .format(multiprocessing.cpu_count()),
+                type=int,
+                default=multiprocessing.cpu_count())
+
+        defaultCacheDir=os.path.abspath(os.path.expanduser(DEFAULT_CACHE_DIR))
+        parser.add_argument('--cacheDir',
+                help='Directory for caches kept between installs (default: {})'
+                        .format(defaultCacheDir),
+                nargs='?',
+                default=defaultCacheDir)
 
+        parser.add_argument('--downloadCacheSize',
+                help='Maximum size in MB of the download cache (default: {})'
+                        .format(DEFAULT_DOWNLOAD_CACHE_SIZE),
+                type=int,
+                default=DEFAULT_DOWNLOAD_CACHE_SIZE)
+
+        parser.add_argument('--noGitMirror',
+                help='Clone directly instead of through local git mirrors (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--noArtifactCache',
+                help='Always build instead of restoring cached build results (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--shallow',
+                help='Fetch only the needed git ref at depth 1 (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--ccache',
+                help='Compile through ccache with a cache in <cacheDir>/ccache (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--ccacheSize',
+                help='Maximum size of the ccache cache (default: 10G)',
+                nargs='?',
+                default='10G')
+
+        parser.add_argument('--rebuild',
+                help='Reuse existing checkouts and build directories, only fetching'
+                        ' and compiling what changed (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--buildInRam',
+                help='Build in a directory in RAM when the build fits in the available memory (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--resume',
+                help='Restart failed ct-ng builds from the step which failed (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--plan',
+                help='Print which apps would be skipped, restored or built and the'
+                        ' estimated time, without installing anything (default: False)',
+                action='store_true',
+                default=False)
+
+        parser.add_argument('--image',
+                help='Image written by "pack" and read by "deploy"'
+                        ' (default: <cacheDir>/images/tools-<host>.img)',
+                nargs='?',
+                default=None)
+
+        parser.add_argument('--imageFormat',
+                help='Format of the image written by "pack", auto is squashfs'
+                        ' if mksquashfs is installed else chunked (default: auto)',
+                choices=['auto', 'squashfs', 'chunked'],
+                default='auto')
+
+        parser.add_argument('--mount',
+                help='"deploy" mounts a squashfs image read-only with squashfuse'
+                        ' at MOUNTPOINT instead of unpacking it, MOUNTPOINT must be'
+                        ' empty or not exist, it is never the install prefix'
+                        ' (default: None)',
+                metavar='MOUNTPOINT',
+                default=None)
+
+        parser.add_argument('--report',
+                help='Path of the json timing report written by install.py'
+                        ' (default: <cacheDir>/reports/install-<time>.json)',
+                nargs='?',
+                default=None)
+
+        parser.add_argument('--logDir',
+                help='Directory for the compressed build logs of each step'
+                        ' (default: <cacheDir>/logs/install-<time>)',
+                nargs='?',
+                default=None)
+
+        parser.add_argument('--offline',
+                help='Only use cached downloads (default: False)',
+                action='store_true',
+                default=False)
 
         # TODO: We must do this so parser "arguments"
         # (apps, forceInstall, codePrefixDir ...)
         # are available here and by instances of InstallArgs.
-        self.knownArgs, self.unknownArgs = parser.parse_known_args(namespace=self)
+        if values is not None:
+            argv = []
+        self.knownArgs, self.unknownArgs = parser.parse_known_args(argv, namespace=self)
         #print('unknownArgs =', self.unknownArgs)
+        if values is not None:
+            defaults = vars(parser.parse_known_args([])[0])
+            for name, value in values.items():
+                if name not in defaults:
+                    raise ValueError('InstallArgs: unknown option {}'.format(name))
+                setattr(self, name, value)
 
         # Be sure the prefix directory paths are expanded and absolute
         self.codePrefixDir = os.path.abspath(
                 os.path.expanduser(self.codePrefixDir))
         self.installPrefixDir = os.path.abspath(
                 os.path.expanduser(self.installPrefixDir))
+        self.installRootDir = self.installPrefixDir
+        self.cacheDir = os.path.abspath(
+                os.path.expanduser(self.cacheDir))
+        runName = time.strftime('install-%Y%m%d-%H%M%S')
+        if self.report is None:
+            self.report = os.path.join(self.cacheDir, 'reports', runName + '.json')
+        self.report = os.path.abspath(os.path.expanduser(self.report))
+        if self.logDir is None:
+            self.logDir = os.path.join(self.cacheDir, 'logs', runName)
+        self.logDir = os.path.abspath(os.path.expanduser(self.logDir))
+        if self.image is not None:
+            self.image = os.path.abspath(os.path.expanduser(self.image))
         if (self.crossDir != ''):
             self.installPrefixDir = os.path.join(self.installPrefixDir, self.crossDir)
 
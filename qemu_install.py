@@ -16,10 +16,16 @@
 
 import utils
 import parseinstallargs
+import jobserver
+import manifest
+import rambuild
+import timing
+import buildlog
 
 import subprocess
 import sys
 import os
+import time
 import shutil
 import multiprocessing
 
@@ -27,60 +33,73 @@ DEFAULT_GIT_VER='2.5.0-rc1'
 DEFAULT_VER='2.4.91'
 APP='qemu-system-arm'
 URL='git://git.qemu.org/qemu.git'
+BUILD_SIZE_MB = 1024 # Estimated size of the build directory
 
 class Installer:
     '''Installer'''
 
     def __init__(self, defaultVer=DEFAULT_VER, defaultGitVer=DEFAULT_GIT_VER,
             defaultCodePrefixDir=None, defaultInstallPrefixDir=None,
-            defaultForceInstall=None):
-        '''See parseinstallargs for defaults prefixes'''
+            defaultForceInstall=None, values=None):
+        '''See parseinstallargs for defaults prefixes and values'''
         self.args = parseinstallargs.InstallArgs(APP,
                 defaultVer=defaultVer,
                 defaultGitVer=defaultGitVer,
                 defaultCodePrefixDir=defaultCodePrefixDir,
                 defaultInstallPrefixDir=defaultInstallPrefixDir,
-                defaultForceInstall=defaultForceInstall)
+                defaultForceInstall=defaultForceInstall,
+                values=values)
+
+    def isInstalled(self):
+        return manifest.fromArgs(self.args).isInstalled(self.args.app, self.args.ver)
 
     def install(self):
         dst_dir = os.path.join(self.args.installPrefixDir, 'bin')
         os.makedirs(dst_dir, exist_ok=True)
         retval = 0
 
-        try:
-            dst = os.path.join(dst_dir, '{app}'.format(app=self.args.app))
-            output = subprocess.check_output([dst, '--version'],
-                    stderr=subprocess.STDOUT)
-            if output is None:
-                output = b''
-        except BaseException as err:
-            output = b''
-
-        if not self.args.forceInstall and bytes(self.args.ver, 'utf-8') in output:
+        if not self.args.forceInstall and self.isInstalled():
             print('{app} {ver} is already installed'
                     .format(app=self.args.app, ver=self.args.ver))
         else:
             print('compiling {app} {ver}'
                     .format(app=self.args.app, ver=self.args.ver))
             code_dir = os.path.join(self.args.codePrefixDir, self.args.app)
-            if self.args.forceInstall:
+            if self.args.forceInstall and not self.args.rebuild:
                 shutil.rmtree(code_dir, ignore_errors=True)
-            os.makedirs(code_dir)
+            os.makedirs(code_dir, exist_ok=self.args.rebuild)
+
+            utils.git_checkout(URL, code_dir, 'v{ver}'.format(ver=self.args.gitver),
+                    utils.git_mirror_dir(self.args), self.args.shallow, submodules=['dtc'],
+                    update=self.args.rebuild)
+            # Build in code_dir/build, or in RAM with --buildInRam
+            with rambuild.buildDir(self.args, os.path.join(code_dir, 'build'),
+                    BUILD_SIZE_MB) as build_dir:
+                os.makedirs(build_dir, exist_ok=True)
+                os.chdir(build_dir)
 
-            utils.git('clone', [URL, code_dir])
-            os.chdir(code_dir)
-            utils.git('checkout', ['v{ver}'.format(ver=self.args.gitver)])
-            utils.git('submodule', ['update', '--init', 'dtc'])
-            os.mkdir('build')
-            os.chdir('build')
+                # configure and make need python2 as python
+                env = utils.python2_env()
 
-            print('configure')
-            utils.bashPython2(
-                    '../configure --prefix={} --target-list=arm-softmmu,arm-linux-user'
-                    .format(self.args.installPrefixDir))
-            utils.bashPython2('make -j {}'.format(multiprocessing.cpu_count()),
-                    stdout=subprocess.DEVNULL)
-            utils.bashPython2('make install')
+                # A rebuild reuses the existing configuration if it's the same
+                configureCmd = [os.path.join(code_dir, 'configure'),
+                        '--prefix={}'.format(self.args.installPrefixDir),
+                        '--target-list=arm-softmmu,arm-linux-user']
+                if not (self.args.rebuild and utils.configured_with(build_dir, configureCmd)):
+                    print('configure')
+                    with timing.span('configure'):
+                        buildlog.run(configureCmd, 'configure', env=env)
+                    utils.mark_configured(build_dir, configureCmd)
+                with timing.span('make'):
+                    buildlog.run(jobserver.makeCmd(), 'make', env=env, pass_fds=jobserver.fds())
+                stage_dir = os.path.join(build_dir, 'stage')
+                shutil.rmtree(stage_dir, ignore_errors=True)
+                with timing.span('install'):
+                    buildlog.run(['make', 'install', 'DESTDIR={}'.format(stage_dir)], 'install',
+                            env=env)
+                    files = utils.install_staged(stage_dir, self.args.installPrefixDir)
+            manifest.fromArgs(self.args).record(self.args.app, self.args.ver,
+                    self.args.installPrefixDir, files=files)
 
         return 0
 
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Build directories on tmpfs for --buildInRam.
+#
+# A build only gets a directory in RAM if its estimated size fits in
+# the memory available less what concurrent builds have reserved and
+# some headroom for the compilers, otherwise it builds on disk. Only
+# the install prefix, which is always on disk, outlives the build.
+
+import utils
+
+import contextlib
+import os
+import shutil
+
+RAM_ROOT = '/dev/shm'
+HEADROOM_MB = 2048 # Left for the compilers themselves
+
+def rootDir():
+    return os.path.join(RAM_ROOT, 'vendor-install-tools-{}'.format(os.getuid()))
+
+def memAvailableMB():
+    '''MemAvailable from /proc/meminfo in MB, 0 if unknown'''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+def freeMB(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize // (1024 * 1024)
+
+def readReservation(path):
+    '''The (pid, sizeMB, kept) of the reservation at path, None if unreadable'''
+    try:
+        with open(path) as f:
+            fields = f.read().split()
+        return int(fields[0]), int(fields[1]), fields[2:] == ['kept']
+    except (OSError, ValueError, IndexError):
+        return None
+
+def isRunning(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def reservedMB(root):
+    '''The MB reserved by builds in root whose process is still running'''
+    total = 0
+    for name in os.listdir(root):
+        if not name.endswith('.reserved'):
+            continue
+        reservation = readReservation(os.path.join(root, name))
+        if reservation is not None and isRunning(reservation[0]):
+            total += reservation[1]
+    return total
+
+def prune(root, keepKept, skip):
+    '''Remove the directories in root left by builds which are no longer
+    running, those kept after a failure too unless keepKept. skip is a
+    directory which is about to be reused.'''
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith('.') or name.endswith('.reserved') or path == skip:
+            continue
+        reservation = readReservation(path + '.reserved')
+        if reservation is not None and (isRunning(reservation[0])
+                or (keepKept and reservation[2])):
+            continue
+        print('rambuild: removing stale build directory', path)
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path + '.reserved'):
+            os.remove(path + '.reserved')
+
+@contextlib.contextmanager
+def buildDir(args, diskDir, sizeMB, keepOnFailure=False):
+    '''Yields the directory to build in instead of diskDir.
+
+    With --buildInRam that's a directory in RAM if sizeMB fits. It's
+    removed afterwards unless the build failed and keepOnFailure, then
+    --resume reuses it whether or not it still fits. Directories left by
+    builds which died, or kept ones when not resuming, are removed. A
+    --rebuild always uses diskDir as that's where the previous build is.
+    '''
+    if not args.buildInRam or args.rebuild or not os.path.isdir(RAM_ROOT):
+        yield diskDir
+        return
+    root = rootDir()
+    os.makedirs(root, exist_ok=True)
+    ramDir = os.path.join(root, diskDir.strip('/').replace('/', '_'))
+    reservation = ramDir + '.reserved'
+    with utils.locked(os.path.join(root, '.lock')):
+        resuming = args.resume and keepOnFailure and os.path.isdir(ramDir)
+        prune(root, args.resume, ramDir if resuming else None)
+        if resuming:
+            # It's already in RAM, the fit check would count it against itself
+            fits = True
+        else:
+            available = (min(memAvailableMB(), freeMB(root)) - reservedMB(root)
+                    - HEADROOM_MB)
+            fits = sizeMB <= available
+        if fits:
+            with open(reservation, 'w') as f:
+                f.write('{} {}'.format(os.getpid(), sizeMB))
+    if not fits:
+        print('rambuild: {}MB needed but only {}MB available, building in {}'
+                .format(sizeMB, available, diskDir))
+        yield diskDir
+        return
+
+    print('rambuild: {} in {} instead of {}'.format('resuming' if resuming else 'building',
+            ramDir, diskDir))
+    succeeded = False
+    try:
+        os.makedirs(ramDir, exist_ok=True)
+        yield ramDir
+        succeeded = True
+    finally:
+        if succeeded or not keepOnFailure:
+            os.remove(reservation)
+            shutil.rmtree(ramDir, ignore_errors=True)
+        else:
+            with open(reservation, 'w') as f:
+                f.write('{} {} kept'.format(os.getpid(), sizeMB))
+            print('rambuild: kept the failed build in {}, rerun with --resume to continue'
+                    ' it, the next run without --resume removes it'.format(ramDir))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Segmented, resumable downloads.
+#
+# A file the server will send in ranges is split in to segments which
+# are fetched in parallel, each in to its own file in <path>.parts, so
+# an interrupted download only refetches what's missing, even in a later
+# run. The parts are only reused if the server still reports the same
+# size and ETag or Last-Modified. The assembled file's size, and sha256
+# if known, are verified before it's moved to path. If the server
+# refuses ranges the file is fetched whole. wget can't request ranges
+# so this uses urllib, the blocking reads run on the event loop's
+# default executor.
+
+import utils
+
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import urllib.error
+import urllib.request
+
+SEGMENTS = 4
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024 # Smaller files aren't worth splitting
+READ_SIZE = 256 * 1024
+RETRIES = 3 # Per segment, each retry resumes where the last stopped
+
+class RangeRefused(IOError):
+    '''The server didn't send the range asked for'''
+
+Info = collections.namedtuple('Info', ['size', 'ranges', 'validator'])
+
+def probe(url, timeout=20):
+    '''The Info of url from a HEAD request, None if the server won't say'''
+    request = urllib.request.Request(url, method='HEAD')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            headers = response.headers
+    except (OSError, ValueError):
+        return None
+    size = headers.get('Content-Length')
+    return Info(int(size) if size is not None and size.isdigit() else None,
+            headers.get('Accept-Ranges', '').strip().lower() == 'bytes',
+            headers.get('ETag') or headers.get('Last-Modified'))
+
+async def probeAsync(url, timeout=20):
+    return await utils.event_loop().run_in_executor(None, probe, url, timeout)
+
+def worthSegmenting(info, segments=SEGMENTS):
+    '''True if a download described by info would be split'''
+    return (info is not None and info.ranges and info.size is not None
+            and segments > 1 and info.size >= 2 * MIN_SEGMENT_SIZE)
+
+def segmentRanges(size, segments):
+    '''Split size bytes in to at most segments (start, end) ranges, end inclusive'''
+    count = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    step = -(-size // count)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+def fetchRange(url, path, start, end, timeout, stop):
+    '''Append bytes start to end of url to path resuming from its size.
+
+    Without a start the whole file is fetched, replacing path. Raises
+    RangeRefused if the server doesn't send the range asked for. stop is a
+    threading.Event which ends the fetch early.
+    '''
+    request = urllib.request.Request(url)
+    offset = 0
+    mode = 'wb'
+    if start is not None:
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if start + offset > end:
+            return
+        request.add_header('Range', 'bytes={}-{}'.format(start + offset, end))
+        mode = 'ab'
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if start is not None:
+            m = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+            if response.status != 206 or not m or int(m.group(1)) != start + offset:
+                raise RangeRefused('rangedownload: {} did not send bytes {}-{}'
+                        .format(url, start + offset, end))
+        with open(path, mode) as f:
+            while not stop.is_set():
+                block = response.read(READ_SIZE)
+                if not block:
+                    break
+                f.write(block)
+    if stop.is_set():
+        raise IOError('rangedownload: {} stopped'.format(url))
+    if start is not None and os.path.getsize(path) != end - start + 1:
+        raise IOError('rangedownload: {} bytes {}-{} incomplete'.format(url, start, end))
+
+async def fetchSegment(url, path, start, end, timeout, stop, retries):
+    '''fetchRange retrying, each attempt resumes from where the last stopped'''
+    loop = utils.event_loop()
+    for attempt in range(retries + 1):
+        try:
+            await loop.run_in_executor(None, fetchRange, url, path, start, end, timeout, stop)
+            return
+        except (OSError, urllib.error.URLError) as e:
+            if stop.is_set() or attempt == retries or isinstance(e, RangeRefused):
+                raise
+            print('rangedownload: retrying {} bytes {}-{} after {}'.format(url, start, end, e))
+
+def sameDownload(meta, url, info, ranges):
+    return (meta.get('url') == url and meta.get('size') == info.size
+            and meta.get('validator') == info.validator and meta.get('ranges') == ranges)
+
+async def download(url, path, timeout=20, sha256=None, segments=SEGMENTS, retries=RETRIES):
+    '''Download url to path, returns its sha256.
+
+    Raises ValueError if the file doesn't match sha256 or the size the
+    server reported. On failure, or if cancelled, the completed parts
+    are kept for the next attempt.
+    '''
+    info = await probeAsync(url, timeout)
+    partsDir = path + '.parts'
+    metaPath = os.path.join(partsDir, 'meta.json')
+    if worthSegmenting(info, segments):
+        ranges = segmentRanges(info.size, segments)
+    else:
+        ranges = [(None, None)]
+    if info is None or not info.ranges or info.validator is None:
+        # Parts of a file which can't be identified can't be resumed
+        shutil.rmtree(partsDir, ignore_errors=True)
+    else:
+        try:
+            with open(metaPath) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        if not sameDownload(meta, url, info, [list(r) for r in ranges]):
+            shutil.rmtree(partsDir, ignore_errors=True)
+    os.makedirs(partsDir, exist_ok=True)
+    with open(metaPath, 'w') as f:
+        json.dump({'url': url, 'size': info.size if info else None,
+                'validator': info.validator if info else None, 'ranges': ranges}, f)
+
+    if ranges == [(None, None)] and info is not None and info.ranges and info.size:
+        # A single segment can still be resumed
+        ranges = [(0, info.size - 1)]
+    print('rangedownload: {} in {} segment(s)'.format(url, len(ranges)))
+    partPaths = [os.path.join(partsDir, 'part{:03d}'.format(i)) for i in range(len(ranges))]
+    stop = threading.Event()
+    try:
+        await utils.gather_async([fetchSegment(url, p, start, end, timeout, stop, retries)
+                for p, (start, end) in zip(partPaths, ranges)])
+    except RangeRefused as e:
+        stop.set()
+        print('{}, fetching it whole'.format(e))
+        shutil.rmtree(partsDir, ignore_errors=True)
+        os.makedirs(partsDir)
+        partPaths = partPaths[:1]
+        await fetchSegment(url, partPaths[0], None, None, timeout, threading.Event(), retries)
+    except BaseException:
+        # The fetches still running in the executor finish their block and stop
+        stop.set()
+        raise
+
+    # Assemble and verify
+    h = hashlib.sha256()
+    size = 0
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as out:
+        for p in partPaths:
+            with open(p, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+                    size += len(block)
+                    out.write(block)
+    actual = h.hexdigest()
+    try:
+        if info is not None and info.size is not None and size != info.size:
+            raise ValueError('rangedownload: {} is {} bytes expected {}'.format(url, size, info.size))
+        if sha256 is not None and actual != sha256:
+            raise ValueError('rangedownload: {} has sha256 {} expected {}'.format(url, actual, sha256))
+    except ValueError:
+        os.remove(tmpPath)
+        shutil.rmtree(partsDir, ignore_errors=True)
+        raise
+    os.replace(tmpPath, path)
+    shutil.rmtree(partsDir, ignore_errors=True)
+    return actual
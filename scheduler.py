@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+import jobserver
+
+import collections
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import traceback
+
+class Scheduler:
+    '''Runs tasks in dependency order with at most jobs running at once.
+
+    Each task runs in its own forked process so installers, which chdir
+    and print freely, can't interfere with each other. A task whose
+    dependency failed is skipped, independent tasks keep running.
+    Ready tasks start in order of their critical path, the longest
+    chain of costs through them and the tasks which depend on them,
+    so the longest builds start first and short ones fill the gaps.
+
+    When a jobserver is active every task owns one of its jobs, the
+    first task runs on the job this process owns and each additional
+    concurrent task must first take a token.
+    '''
+
+    def __init__(self, jobs=1):
+        '''jobs is the maximum number of concurrent tasks, 0 is no limit'''
+        self.jobs = jobs
+        self.tasks = collections.OrderedDict()
+
+    def add(self, name, func, deps=None, cost=0):
+        '''Add task name which runs func(), deps are names of other tasks.
+
+        Dependencies on tasks that are never added are ignored, they
+        are assumed to be satisfied already. cost is its expected
+        duration, tasks with equal critical paths start in the
+        order they were added.
+        '''
+        if deps is None:
+            deps = []
+        self.tasks[name] = (func, list(deps), cost)
+
+    def deps(self):
+        '''A dict of each task to the added tasks it depends on'''
+        return dict((name, [d for d in taskDeps if d in self.tasks])
+                for name, (func, taskDeps, cost) in self.tasks.items())
+
+    def criticalPaths(self):
+        '''A dict of each task to the cost of the longest chain of tasks
+        starting with it'''
+        dependents = dict((name, []) for name in self.tasks)
+        for name, taskDeps in self.deps().items():
+            for d in taskDeps:
+                dependents[d].append(name)
+        paths = {}
+        def path(name, seen):
+            if name not in paths:
+                if name in seen:
+                    raise ValueError('scheduler: dependency cycle through {}'.format(name))
+                paths[name] = self.tasks[name][2] + max(
+                        [path(d, seen + [name]) for d in dependents[name]] or [0])
+            return paths[name]
+        for name in self.tasks:
+            path(name, [])
+        return paths
+
+    def order(self):
+        '''The task names, longest critical path first'''
+        paths = self.criticalPaths()
+        names = list(self.tasks.keys())
+        return sorted(names, key=lambda n: (-paths[n], names.index(n)))
+
+    def simulate(self):
+        '''The expected wall time to run all the tasks, from their costs.
+
+        Tasks are started as run() would, assuming they don't slow each
+        other down, returns the finish time and a dict of each task's
+        (start, finish).
+        '''
+        deps = self.deps()
+        pending = self.order()
+        running = {}
+        times = {}
+        now = 0
+        while pending or running:
+            for name in list(pending):
+                if self.jobs > 0 and len(running) >= self.jobs:
+                    break
+                if all(d in times and times[d][1] <= now for d in deps[name]):
+                    times[name] = (now, now + self.tasks[name][2])
+                    running[name] = times[name][1]
+                    pending.remove(name)
+            if not running:
+                raise ValueError('scheduler: dependency cycle in {}'.format(pending))
+            now = min(running.values())
+            running = dict((n, f) for n, f in running.items() if f > now)
+        return now, times
+
+    def _runTask(self, name, func):
+        try:
+            retval = func()
+        except BaseException:
+            traceback.print_exc()
+            retval = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(retval if isinstance(retval, int) else 0)
+
+    def run(self):
+        '''Run all tasks, returns a dict of name to exit code.
+
+        Skipped tasks have an exit code of None.
+        '''
+        ctx = multiprocessing.get_context('fork')
+        deps = self.deps()
+
+        pending = self.order()
+        running = {}
+        results = {}
+        while pending or running:
+            # Skip anything that depends on a failed or skipped task
+            for name in list(pending):
+                if any(d in results and results[d] != 0 for d in deps[name]):
+                    print('scheduler: skipping {} as a dependency failed'.format(name))
+                    results[name] = None
+                    pending.remove(name)
+
+            # Start ready tasks, longest critical path first
+            waitingForToken = False
+            for name in list(pending):
+                if self.jobs > 0 and len(running) >= self.jobs:
+                    break
+                if all(results.get(d) == 0 for d in deps[name]):
+                    token = None
+                    if jobserver.active() and any(t is None for (n, p, t) in running.values()):
+                        token = jobserver.tryAcquire()
+                        if token is None:
+                            waitingForToken = True
+                            break
+                    print('scheduler: starting {}'.format(name))
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    func = self.tasks[name][0]
+                    p = ctx.Process(target=self._runTask, args=(name, func), name=name)
+                    p.start()
+                    running[p.sentinel] = (name, p, token)
+                    pending.remove(name)
+
+            if not running:
+                if pending:
+                    raise ValueError('scheduler: dependency cycle in {}'.format(pending))
+                continue
+
+            waitList = list(running.keys())
+            if waitingForToken:
+                waitList.append(jobserver.readFd())
+            for sentinel in multiprocessing.connection.wait(waitList):
+                if sentinel not in running:
+                    continue
+                name, p, token = running.pop(sentinel)
+                if token is not None:
+                    jobserver.release(token)
+                p.join()
+                results[name] = p.exitcode
+                print('scheduler: {} {}'.format(name,
+                    'done' if p.exitcode == 0 else 'FAILED exitcode={}'.format(p.exitcode)))
+        return results
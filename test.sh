@@ -26,81 +26,17 @@ DEFAULT_INSTALL_PREFIX_DIR=$HOME/opt
 ALT_CODE_PREFIX_DIR=$HOME/tmpx
 ALT_INSTALL_PREFIX_DIR=$HOME/optx
 
-# Default install paths, we expect the executables
-# to be installed in these paths
-DFLT_INSTALL_PATHS=("${DEFAULT_INSTALL_PREFIX_DIR}/bin"
-  "${DEFAULT_INSTALL_PREFIX_DIR}/cross/bin"
-  "${DEFAULT_INSTALL_PREFIX_DIR}/x-tools/x86_64-unknown-elf/bin"
-  "${DEFAULT_INSTALL_PREFIX_DIR}/x-tools/i386-unknown-elf/bin"
-  "${DEFAULT_INSTALL_PREFIX_DIR}/x-tools/arm-unknown-eabi/bin")
-
-ALT_INSTALL_PATHS=("${ALT_INSTALL_PREFIX_DIR}/bin"
-  "${ALT_INSTALL_PREFIX_DIR}/cross/bin"
-  "${ALT_INSTALL_PREFIX_DIR}/x-tools/x86_64-unknown-elf/bin"
-  "${ALT_INSTALL_PREFIX_DIR}/x-tools/i386-unknown-elf/bin"
-  "${ALT_INSTALL_PREFIX_DIR}/x-tools/arm-unknown-eabi/bin")
-
-add_install_paths_to_org_path () {
-  declare -a ary1=("${!1}")
-  export INSTALL_PATHS="${ary1[@]}"
-  for install_path in "${ary1[@]}"; do
-    export PATH=${install_path}:${PATH}
-  done
+# Verify apps or binaries, all_apps if none, are installed in
+# INSTALL_PREFIX_DIR with the versions the installers expect
+verify () {
+  if ! ${THIS_DIR}/install.py verify "$@" --installPrefixDir ${INSTALL_PREFIX_DIR}; then
+    echo "Error verifying $@"
+    exit 1
+  fi
 }
 
-# First parameter is the name of the app
-#
-# Second parameter is the is passed to the app to get its version
-#
-# Third parameter is the is code to get the expected version
-test_installed () {
-  app=$1
-  versionParam=$2
-  getExpectedVer=$3
-
-  # Check if ${app} installed at all, capturing all of
-  # which's output so as to not spew console
-  whichOutput=$(which ${app} 2>&1)
-  whichExitCode=$?
-  [[ ${whichExitCode} != 0 ]] && echo ${app} not installed && exit 1
-
-  # It is but is it in the expected directories ${INSTALL_PATHS} which
-  # is a bash associative array and in the loop below we check it.
-  whichDir=$(dirname ${whichOutput})
-  OK=0
-  for install_path in ${INSTALL_PATHS[@]}; do
-    [[ "${whichDir}" == *"${install_path}"* ]] && OK=1
-  done
-  [[ ${OK} == 0 ]] && echo ${app} not installed in ${INSTALL_PATHS[@]} && exit 1
-
-  # Now get the expected version
-  expectedVer=$(${getExpectedVer} 2>&1)
-
-  # Next get the actual version
-  actualVer=$(${app} ${versionParam} 2>&1)
-
-  # Finally verify the expectedVer is contained in the actualVer output
-  [[ ${actualVer} != *"${expectedVer}"* ]] && \
-    printf "$1 BAD version reported:\n-----\n${actualVer}\n-----\nBut expected ${expectedVer}\n" && exit 1
-
-  echo $1 OK "ver=${expectedVer}"
-}
-
-
 test_all () {
-  test_installed ninja "--version" "${THIS_DIR}/ninja_install.py printVer"
-  test_installed meson "-v" "${THIS_DIR}/meson_install.py printVer"
-  test_installed ct-ng "version" "${THIS_DIR}/crosstool_ng_install.py printVer"
-  #test_installed arm-eabi-ld "--version" "${THIS_DIR}/binutils_install.py printVer"
-  #test_installed arm-eabi-gdb "--version" "${THIS_DIR}/binutils_install.py printGdbVer"
-  #test_installed arm-eabi-gcc "--version" "${THIS_DIR}/gcc_install.py printVer"
-  test_installed x86_64-unknown-elf-ld "--version" "${THIS_DIR}/ct_ng_runner.py printBinuVer"
-  test_installed x86_64-unknown-elf-gcc "--version" "${THIS_DIR}/ct_ng_runner.py printGccIntrAttrVer"
-  test_installed i386-unknown-elf-ld "--version" "${THIS_DIR}/ct_ng_runner.py printBinuVer"
-  test_installed i386-unknown-elf-gcc "--version" "${THIS_DIR}/ct_ng_runner.py printGccIntrAttrVer"
-  test_installed arm-unknown-eabi-ld "--version" "${THIS_DIR}/ct_ng_runner.py printBinuVer"
-  test_installed arm-unknown-eabi-gcc "--version" "${THIS_DIR}/ct_ng_runner.py printGccVer"
-  test_installed qemu-system-arm "--version" "${THIS_DIR}/qemu_install.py printVer"
+  verify
 }
 
 
@@ -123,8 +59,7 @@ force_install () {
   [[ $? != 0 ]] && echo "Error forceInstall" && exit 1
 
   # Test ninja and meson again
-  test_installed ninja "--version" "${THIS_DIR}/ninja_install.py printVer"
-  test_installed meson "-v" "${THIS_DIR}/meson_install.py printVer"
+  verify ninja meson
 }
 
 alt_install() {
@@ -136,7 +71,7 @@ alt_install() {
   [[ $? != 0 ]] && echo "Error alternate install" && exit 1
 
   # Test all on the ALT paths
-  add_install_paths_to_org_path ALT_INSTALL_PATHS[@]
+  INSTALL_PREFIX_DIR=${ALT_INSTALL_PREFIX_DIR}
   test_all
 }
 
@@ -178,8 +113,7 @@ if [[ "$2" != "" ]]; then
   DEFAULT_INSTALL_PREFIX_DIR=$2
 fi
 
-# Add DFLT_INSTALL_PATHS to the orginal path
-add_install_paths_to_org_path DFLT_INSTALL_PATHS[@]
+INSTALL_PREFIX_DIR=${DEFAULT_INSTALL_PREFIX_DIR}
 
 case $1 in
 "quick")
@@ -197,45 +131,12 @@ case $1 in
 "full")
   full_install
   ;;
-"ninja")
-  test_installed ninja "--version" "${THIS_DIR}/ninja_install.py printVer"
-  ;;
-"meson")
-  test_installed meson "-v" "${THIS_DIR}/meson_install.py printVer"
-  ;;
-"ct-ng")
-  test_installed ct-ng "version" "${THIS_DIR}/crosstool_ng_install.py printVer"
-  ;;
-"arm-eabi-ld")
-  test_installed arm-eabi-ld "--version" "${THIS_DIR}/binutils_install.py printVer"
-  ;;
-"arm-eabi-gdb")
-  test_installed arm-eabi-gdb "--version" "${THIS_DIR}/binutils_install.py printGdbVer"
-  ;;
-"arm-eabi-gcc")
-  test_installed arm-eabi-gcc "--version" "${THIS_DIR}/gcc_install.py printVer"
-  ;;
-"qemu-system-arm")
-  test_installed qemu-system-arm "--version" "${THIS_DIR}/qemu_install.py printVer"
-  ;;
-"x86_64-unknown-elf-ld")
-   test_installed x86_64-unknown-elf-ld "--version" "${THIS_DIR}/ct_ng_runner.py printBinuVer"
-   ;;
-"x86_64-unknown-elf-gcc")
-   test_installed x86_64-unknown-elf-gcc "--version" "${THIS_DIR}/ct_ng_runner.py printGccIntrAttrVer"
-   ;;
-"i386-unknown-elf-ld")
-   test_installed i386-unknown-elf-ld "--version" "${THIS_DIR}/ct_ng_runner.py printBinuVer"
-   ;;
-"i386-unknown-elf-gcc")
-   test_installed i386-unknown-elf-gcc "--version" "${THIS_DIR}/ct_ng_runner.py printGccIntrAttrVer"
-   ;;
-"arm-unknown-eabi-ld")
-   test_installed arm-unknown-eabi-ld "--version" "${THIS_DIR}/ct_ng_runner.py printBinuVer"
-   ;;
+"ninja" | "meson" | "ct-ng" | "arm-eabi-ld" | "arm-eabi-gdb" | "arm-eabi-gcc" | \
+"qemu-system-arm" | "x86_64-unknown-elf-ld" | "x86_64-unknown-elf-gcc" | \
+"i386-unknown-elf-ld" | "i386-unknown-elf-gcc" | "arm-unknown-eabi-ld" | \
 "arm-unknown-eabi-gcc")
-   test_installed arm-unknown-eabi-ld "--version" "${THIS_DIR}/ct_ng_runner.py printGccVer"
-   ;;
+  verify $1
+  ;;
 *)
   help
   ;;
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Timing and resource spans for the phases of an install.
+#
+# Each span records its wall time, the user and sys cpu time of this
+# process and the children it waited for, the peak rss of those
+# children and the bytes downloaded in it. install.py calls start(),
+# every process it forks then appends its spans to a file of its own
+# in that directory and writeReport() merges them in to a chrome
+# trace-event json file, viewable in chrome://tracing or perfetto.
+# Without start() spans are only printed.
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+ENV_NAME = 'INSTALL_TIMING_DIR'
+
+_app = ''
+_lock = threading.Lock()
+
+def start(dirPath):
+    '''Record the spans of this process and its children in dirPath'''
+    os.makedirs(dirPath, exist_ok=True)
+    os.environ[ENV_NAME] = dirPath
+
+def setApp(app):
+    '''Name the app the spans of this process belong to'''
+    global _app
+    _app = app
+
+def app():
+    '''The app the spans of this process belong to'''
+    return _app
+
+@contextlib.contextmanager
+def span(name, **fields):
+    '''Time the with block as the phase name, fields are added to its record.
+
+    maxRssKb is the high water mark of the children this process has
+    waited for so far, so it includes children of earlier spans. Code
+    that downloads adds the byte count to the record's 'bytes'. Spans
+    of concurrent tasks overlap so their cpu times do too.
+    '''
+    record = {'name': name, 'app': _app, 'pid': os.getpid(),
+            'tid': threading.get_ident(), 'bytes': 0, 'ok': False}
+    record.update(fields)
+    startSelf = resource.getrusage(resource.RUSAGE_SELF)
+    startChildren = resource.getrusage(resource.RUSAGE_CHILDREN)
+    record['start'] = time.time()
+    startWall = time.monotonic()
+    try:
+        yield record
+        record['ok'] = True
+    finally:
+        record['wall'] = time.monotonic() - startWall
+        endSelf = resource.getrusage(resource.RUSAGE_SELF)
+        endChildren = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record['user'] = ((endSelf.ru_utime - startSelf.ru_utime) +
+                (endChildren.ru_utime - startChildren.ru_utime))
+        record['sys'] = ((endSelf.ru_stime - startSelf.ru_stime) +
+                (endChildren.ru_stime - startChildren.ru_stime))
+        record['maxRssKb'] = endChildren.ru_maxrss
+        print('timing: {app} {name} {status} wall={wall:.1f}s user={user:.1f}s'
+                ' sys={sys:.1f}s maxRss={rss:.0f}MB downloaded={mb:.1f}MB'
+                .format(app=record['app'], name=name,
+                    status='ok' if record['ok'] else 'FAILED',
+                    wall=record['wall'], user=record['user'], sys=record['sys'],
+                    rss=record['maxRssKb'] / 1024, mb=record['bytes'] / (1024 * 1024)))
+        _save(record)
+
+def _save(record):
+    dirPath = os.environ.get(ENV_NAME)
+    if not dirPath:
+        return
+    path = os.path.join(dirPath, 'spans-{}.jsonl'.format(os.getpid()))
+    with _lock:
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+def loadSpans(dirPath):
+    '''All the spans recorded in dirPath ordered by start time'''
+    spans = []
+    for name in os.listdir(dirPath):
+        if name.startswith('spans-') and name.endswith('.jsonl'):
+            with open(os.path.join(dirPath, name)) as f:
+                spans.extend(json.loads(line) for line in f if line.strip())
+    return sorted(spans, key=lambda s: s['start'])
+
+def summary(spans):
+    '''Per app totals of spans.
+
+    The span named after the app covers the whole install, the
+    others are its phases. bytes is the sum over all its spans.
+    '''
+    apps = {}
+    for s in spans:
+        app = apps.setdefault(s['app'], {'wall': 0.0, 'user': 0.0, 'sys': 0.0,
+                'maxRssKb': 0, 'bytes': 0, 'phases': {}})
+        app['bytes'] += s['bytes']
+        app['maxRssKb'] = max(app['maxRssKb'], s['maxRssKb'])
+        if s['name'] == s['app']:
+            app['wall'] += s['wall']
+            app['user'] += s['user']
+            app['sys'] += s['sys']
+        else:
+            app['phases'][s['name']] = app['phases'].get(s['name'], 0.0) + s['wall']
+    return apps
+
+def writeReport(dirPath, reportPath):
+    '''Merge the spans in dirPath in to a trace-event report at reportPath'''
+    spans = loadSpans(dirPath)
+    if len(spans) == 0:
+        return
+    origin = spans[0]['start']
+    events = []
+    names = {}
+    for s in spans:
+        names.setdefault(s['pid'], s['app'])
+        args = dict((k, v) for k, v in s.items()
+                if k not in ('name', 'pid', 'tid', 'start', 'wall'))
+        events.append({'name': s['name'], 'cat': s['app'], 'ph': 'X',
+                'ts': int((s['start'] - origin) * 1e6), 'dur': int(s['wall'] * 1e6),
+                'pid': s['pid'], 'tid': s['tid'], 'args': args})
+    for pid, app in names.items():
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                'args': {'name': app or 'install.py'}})
+    apps = summary(spans)
+    report = {'traceEvents': events, 'displayTimeUnit': 'ms', 'apps': apps}
+    os.makedirs(os.path.dirname(reportPath), exist_ok=True)
+    with open(reportPath, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+    print('timing: report written to', reportPath)
+    for name, app in sorted(apps.items(), key=lambda a: -a[1]['wall']):
+        phases = ', '.join('{}={:.0f}s'.format(p, w)
+                for p, w in sorted(app['phases'].items(), key=lambda p: -p[1]))
+        print('timing: {:<20} wall={:7.0f}s cpu={:7.0f}s downloaded={:7.1f}MB {}'
+                .format(name or '-', app['wall'], app['user'] + app['sys'],
+                    app['bytes'] / (1024 * 1024), phases))
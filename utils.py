@@ -14,51 +14,620 @@
 # see the license for the specific language governing permissions and
 # limitations under the license.
 
+import jobserver
+import timing
+import buildlog
+import rangedownload
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import re
 import subprocess
 import os
+import shutil
 import traceback
 from urllib.parse import urlparse
 
+STREAM_BLOCK_SIZE = 256 * 1024
+
+# Leading bytes of the compressed formats and the matching tar option
+COMPRESSION_MAGIC = [
+        (b'\x1f\x8b', '--gzip'),
+        (b'BZh', '--bzip2'),
+        (b'\xfd7zXZ\x00', '--xz'),
+        (b'\x28\xb5\x2f\xfd', '--zstd'),
+]
+
+# Multi-threaded decompressors for each tar option in order of preference,
+# the first installed is used. tar adds -d when it runs them.
+PARALLEL_DECOMPRESSORS = {
+        '--gzip': [['pigz']],
+        '--bzip2': [['lbzip2'], ['pbzip2']],
+        '--xz': [['xz', '-T0'], ['pixz']],
+}
+# xz only decompresses in threads from 5.4
+XZ_THREADED_VERSION = (5, 4)
+
+def tar_compression_option(header):
+    '''The tar option to decompress an archive starting with header'''
+    for magic, option in COMPRESSION_MAGIC:
+        if header.startswith(magic):
+            return [option]
+    return []
+
+_decompressors = {}
+
+async def _usable_decompressor(cmd):
+    if shutil.which(cmd[0]) is None:
+        return False
+    if cmd[0] == 'xz':
+        m = re.search(r'(\d+)\.(\d+)', await output_async(['xz', '--version']))
+        return m is not None and (int(m.group(1)), int(m.group(2))) >= XZ_THREADED_VERSION
+    return True
+
+async def decompress_option_async(header, parallel=True):
+    '''The tar options and the name of the decompressor for an archive
+    starting with header.
+
+    With parallel the first usable command in PARALLEL_DECOMPRESSORS for
+    the format is used, otherwise, or if there's none, tar's own option.
+    '''
+    option = tar_compression_option(header)
+    if not option:
+        return [], 'none'
+    if parallel:
+        if option[0] not in _decompressors:
+            _decompressors[option[0]] = None
+            for cmd in PARALLEL_DECOMPRESSORS.get(option[0], []):
+                if await _usable_decompressor(cmd):
+                    _decompressors[option[0]] = cmd
+                    break
+        cmd = _decompressors[option[0]]
+        if cmd is not None:
+            return ['--use-compress-program=' + ' '.join(cmd)], ' '.join(cmd)
+    return option, option[0].lstrip('-')
+
+def print_throughput(what, url, nbytes, record):
+    '''Print the rate nbytes were processed at in the span record'''
+    print('{}: {:.1f}MB in {:.2f}s, {:.1f}MB/s with {} url={}'.format(what,
+            nbytes / (1024 * 1024), record['wall'],
+            nbytes / (1024 * 1024) / max(record['wall'], 1e-6), record['decompressor'], url))
+
+_loop = None
+_loopPid = None
+
+def event_loop():
+    '''The asyncio event loop children of this process are run from.
+
+    A process forked from this one gets a new loop as the
+    parent's loop can't be shared.
+    '''
+    global _loop, _loopPid
+    if _loop is None or _loop.is_closed() or _loopPid != os.getpid():
+        _loop = asyncio.new_event_loop()
+        _loopPid = os.getpid()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+KILL_DRAIN_TIMEOUT = 5 # Seconds
+
+async def kill_async(proc):
+    '''Kill proc and wait for it to exit.
+
+    Its pipes are drained and closed too, unless a child of proc
+    still holds them KILL_DRAIN_TIMEOUT seconds after it exited.
+    '''
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+    try:
+        await asyncio.wait_for(proc.communicate(), KILL_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        # The wait also waits for the pipes, closing the transport closes
+        # them, it's been the Process's attribute since asyncio was added.
+        proc._transport.close()
+        await proc.wait()
+
+async def start_async(cmd, cwd=None, env=None, pass_fds=(), stdin=None,
+        stdout=None, stderr=None):
+    '''Start cmd, a list of the program and its arguments, without a shell'''
+    return await asyncio.create_subprocess_exec(*cmd, cwd=cwd, env=env,
+            pass_fds=pass_fds, stdin=stdin, stdout=stdout, stderr=stderr)
+
+async def wait_async(proc, cmd, timeout=None, check=True):
+    '''Wait for proc started with cmd, returns its exit code.
+
+    proc is killed if it takes longer than timeout seconds, raising
+    TimeoutExpired, or if the wait is cancelled. With check a non zero
+    exit code raises CalledProcessError.
+    '''
+    try:
+        returncode = await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        await kill_async(proc)
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        await kill_async(proc)
+        raise
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
+
+async def run_async(cmd, timeout=None, check=True, **kwargs):
+    '''Run cmd, returns its exit code, see start_async and wait_async'''
+    proc = await start_async(cmd, **kwargs)
+    return await wait_async(proc, cmd, timeout, check)
+
+async def output_async(cmd, timeout=None, **kwargs):
+    '''Run cmd, returns its stdout as a str, a non zero exit code raises'''
+    proc = await start_async(cmd, stdout=subprocess.PIPE, **kwargs)
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        await kill_async(proc)
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        await kill_async(proc)
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return output.decode('utf-8', 'replace')
+
+async def gather_async(coros):
+    '''Run coros concurrently, returns their results in order.
+
+    The first to fail cancels the others, which are awaited so
+    their children are gone, and its exception is raised.
+    '''
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.wait(tasks)
+        raise
+    failed = [t for t in tasks if t.done() and not t.cancelled() and t.exception() is not None]
+    if failed:
+        pending = [t for t in tasks if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        raise failed[0].exception()
+    return [t.result() for t in tasks]
+
+def run(cmd, timeout=None, check=True, **kwargs):
+    '''Run cmd to completion, see run_async'''
+    return event_loop().run_until_complete(run_async(cmd, timeout, check, **kwargs))
+
+def output(cmd, timeout=None, **kwargs):
+    '''Run cmd to completion returning its stdout, see output_async'''
+    return event_loop().run_until_complete(output_async(cmd, timeout, **kwargs))
+
+def run_all(cmds, timeout=None, **kwargs):
+    '''Run all the cmds concurrently, the first failure kills the rest and is raised'''
+    return event_loop().run_until_complete(
+            gather_async([run_async(cmd, timeout, **kwargs) for cmd in cmds]))
+
 def git(cmd, params):
     if cmd is None:
         return
     cmds = ['git', cmd]
     if not params is None:
         cmds.extend(params)
-    subprocess.check_call(cmds)
+    run(cmds)
+
+def files_changed_since(root, since=None):
+    '''The paths relative to root of the files and symlinks under root
+    modified at or after the time since, or all of them if since is None.
+    '''
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            path = os.path.join(dirpath, name)
+            if since is None or os.lstat(path).st_mtime >= since:
+                files.append(os.path.relpath(path, root))
+    return sorted(files)
+
+CONFIGURE_STAMP = '.configure-cmd.json'
+
+def configured_with(build_dir, cmd):
+    '''True if build_dir has a Makefile from configuring it with cmd, see
+    mark_configured. A rebuild must rerun configure otherwise, as a
+    changed prefix, target or flag isn't picked up by make.'''
+    try:
+        with open(os.path.join(build_dir, CONFIGURE_STAMP)) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return stamp == cmd and os.path.exists(os.path.join(build_dir, 'Makefile'))
+
+def mark_configured(build_dir, cmd):
+    '''Record that configuring build_dir with cmd succeeded'''
+    with open(os.path.join(build_dir, CONFIGURE_STAMP), 'w') as f:
+        json.dump(cmd, f)
+
+EXTRACT_STAMP = '.extracted-from.json'
+
+def extracted_from(dst_path, url):
+    '''True if dst_path holds the source extracted from url, see
+    mark_extracted. A rebuild must extract it again otherwise, as the
+    tree left by another version would be built as this one.'''
+    try:
+        with open(os.path.join(dst_path, EXTRACT_STAMP)) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return stamp == url
 
-def wget_extract(url, tmp_dir='.', dst_path='.', timeout=20):
+def mark_extracted(dst_path, url):
+    '''Record that the source in dst_path was extracted from url'''
+    with open(os.path.join(dst_path, EXTRACT_STAMP), 'w') as f:
+        json.dump(url, f)
+
+def install_staged(stage_dir, prefix):
+    '''Move the files a "make install DESTDIR=stage_dir" put in stage_dir
+    in to prefix, returns their paths relative to prefix.
+
+    Staging keeps the files of concurrent installs in to the same
+    prefix apart, each install knows exactly which files are its own.
+    '''
+    staged = os.path.join(stage_dir, os.path.abspath(prefix).lstrip(os.sep))
+    files = files_changed_since(staged) if os.path.isdir(staged) else []
+    for name in files:
+        src = os.path.join(staged, name)
+        dst = os.path.join(prefix, name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.lexists(dst) and (os.path.islink(src) or os.path.islink(dst)):
+            os.remove(dst)
+        shutil.move(src, dst)
+    shutil.rmtree(stage_dir, ignore_errors=True)
+    return files
+
+def git_mirror_dir(args):
+    '''The directory of the git mirrors for InstallArgs args or None'''
+    if args.noGitMirror:
+        return None
+    return os.path.join(args.cacheDir, 'git')
+
+@contextlib.contextmanager
+def locked(path, exclusive=True):
+    '''Holds a flock on path while in the with block'''
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+def git_mirror_path(url, mirror_dir):
+    '''The path of the bare mirror of url in mirror_dir, which may not exist'''
+    name = re.sub(r'[^A-Za-z0-9.-]+', '_', re.sub(r'^[a-z+]+://', '', url))
+    if not name.endswith('.git'):
+        name += '.git'
+    return os.path.join(mirror_dir, name)
+
+def git_mirror(url, mirror_dir):
+    '''Create or update the bare mirror of url in mirror_dir, returns its path'''
+    mirror = git_mirror_path(url, mirror_dir)
+    os.makedirs(mirror_dir, exist_ok=True)
+    with locked(mirror + '.lock'):
+        if os.path.exists(os.path.join(mirror, 'HEAD')):
+            print('git_mirror: update', mirror)
+            git('--git-dir={}'.format(mirror), ['remote', 'update', '--prune'])
+        else:
+            print('git_mirror: create', mirror)
+            shutil.rmtree(mirror, ignore_errors=True)
+            git('clone', ['--mirror', url, mirror])
+    return mirror
+
+def git_resolve(url, branch, mirror_dir=None, offline=False, checkout=None):
+    '''The commit sha branch of url is at or None if it can't be found.
+
+    url is asked unless offline, then its mirror in mirror_dir, which
+    isn't updated, and last the HEAD of checkout, an existing clone.
+    '''
+    ref = 'refs/heads/{}'.format(branch)
+    if not offline:
+        try:
+            for line in output(['git', 'ls-remote', url, ref], timeout=60).splitlines():
+                sha, name = line.split()
+                if name == ref:
+                    return sha
+        except (OSError, subprocess.SubprocessError):
+            print('git_resolve: ls-remote {} of {} failed'.format(ref, url))
+    tries = []
+    if mirror_dir is not None:
+        tries.append(['git', '--git-dir={}'.format(git_mirror_path(url, mirror_dir)),
+                'rev-parse', '--verify', '-q', ref])
+    if checkout is not None:
+        tries.append(['git', '-C', checkout, 'rev-parse', '--verify', '-q', 'HEAD'])
+    for cmd in tries:
+        try:
+            return output(cmd, stderr=subprocess.DEVNULL).strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    return None
+
+def git_clone(url, dst, mirror_dir=None, branch=None, depth=None):
+    '''Clone url to dst.
+
+    With a mirror_dir the clone is made from a local mirror of url, which
+    is updated first, so only new objects are fetched from url and the
+    rest are hard linked. The clone's origin is then set back to url.
+    depth is ignored when cloning from a mirror.
+    '''
+    params = []
+    if branch is not None:
+        params += ['--branch', branch]
+    if mirror_dir is None:
+        if depth is not None:
+            params += ['--depth', str(depth), '--single-branch']
+        git('clone', params + [url, dst])
+        return
+    mirror = git_mirror(url, mirror_dir)
+    with locked(mirror + '.lock', exclusive=False):
+        git('clone', params + [mirror, dst])
+    git('-C', [dst, 'remote', 'set-url', 'origin', url])
+
+def git_checkout(url, dst, ref, mirror_dir=None, shallow=False, submodules=None,
+        update=False):
+    '''Get ref, a tag, branch or commit, of url checked out in dst.
+
+    With shallow only ref is fetched at depth 1, if the server can't
+    provide ref that way (for instance an abbreviated commit) this falls
+    back to a full clone, through mirror_dir if supplied. submodules is
+    a list of the submodules to init, others are left alone. With update
+    an existing checkout in dst is reused, only new objects are fetched.
+    '''
+    checked_out = False
+    if update and os.path.isdir(os.path.join(dst, '.git')):
+        git_update(url, dst, ref, mirror_dir, shallow)
+        checked_out = True
+        shallow = False
+    elif shallow:
+        try:
+            print('git_checkout: shallow fetch {} of {}'.format(ref, url))
+            with timing.span('clone', url=url, shallow=True):
+                os.makedirs(dst, exist_ok=True)
+                git('-C', [dst, 'init', '-q'])
+                git('-C', [dst, 'remote', 'add', 'origin', url])
+                git('-C', [dst, 'fetch', '--depth', '1', 'origin', ref])
+            with timing.span('checkout', ref=ref):
+                git('-C', [dst, 'checkout', '-q', 'FETCH_HEAD'])
+            checked_out = True
+        except subprocess.CalledProcessError:
+            print('git_checkout: shallow fetch failed, cloning', url)
+            shutil.rmtree(dst, ignore_errors=True)
+            shallow = False
+    if not checked_out:
+        with timing.span('clone', url=url, shallow=False):
+            git_clone(url, dst, mirror_dir)
+        with timing.span('checkout', ref=ref):
+            git('-C', [dst, 'checkout', ref])
+    if submodules:
+        cwd = os.getcwd()
+        os.chdir(dst)
+        try:
+            with timing.span('clone', submodules=submodules, shallow=shallow):
+                git_submodule_update(submodules, mirror_dir, shallow)
+        finally:
+            os.chdir(cwd)
+
+def git_update(url, dst, ref, mirror_dir=None, shallow=False):
+    '''Fetch ref of url in to the existing checkout dst and check it out'''
+    print('git_update: fetch {} of {} in to {}'.format(ref, url, dst))
+    with timing.span('fetch', url=url, shallow=shallow):
+        if shallow:
+            try:
+                git('-C', [dst, 'fetch', '--depth', '1', 'origin', ref])
+                ref = 'FETCH_HEAD'
+            except subprocess.CalledProcessError:
+                print('git_update: shallow fetch failed, fetching', url)
+                shallow = False
+        if not shallow:
+            fetch = ['fetch', '--tags']
+            if mirror_dir is None:
+                git('-C', [dst] + fetch + ['origin'])
+            else:
+                mirror = git_mirror(url, mirror_dir)
+                with locked(mirror + '.lock', exclusive=False):
+                    git('-C', [dst] + fetch + [mirror, '+refs/heads/*:refs/remotes/origin/*'])
+    with timing.span('checkout', ref=ref):
+        git('-C', [dst, 'checkout', '-q', ref])
+
+def git_submodule_update(names, mirror_dir=None, shallow=False):
+    '''Init and update the submodules names of the repo in the current directory
+
+    With shallow only the recorded commit is fetched at depth 1, if the
+    server can't provide it that way the submodule is fetched in full,
+    as it is without shallow. A full fetch borrows objects from the
+    submodule's local mirror in mirror_dir if supplied.
+    '''
+    for name in names:
+        if shallow:
+            try:
+                git('submodule', ['update', '--init', '--depth', '1', name])
+                continue
+            except subprocess.CalledProcessError:
+                print('git_submodule_update: shallow fetch of {} failed, fetching it in full'
+                        .format(name))
+                git('submodule', ['deinit', '-f', name])
+                shutil.rmtree(os.path.join('.git', 'modules', name), ignore_errors=True)
+        params = ['update', '--init']
+        if mirror_dir is not None:
+            url = output(['git', 'config', '-f', '.gitmodules',
+                    'submodule.{}.url'.format(name)]).strip()
+            mirror = git_mirror(url, mirror_dir)
+            params += ['--reference', mirror]
+        git('submodule', params + [name])
+
+def wget_extract(url, tmp_dir='.', dst_path='.', timeout=20, cache=None, sha256=None,
+        stream=True):
+    '''Gets a file using wget and then extracts the tar file, see wget_extract_async'''
+    event_loop().run_until_complete(wget_extract_async(url, tmp_dir, dst_path, timeout,
+            cache, sha256, stream))
+
+async def wget_extract_async(url, tmp_dir='.', dst_path='.', timeout=20, cache=None, sha256=None,
+        stream=True):
     '''Gets a file using wget and then extracts the tar file.
+
+    If cache, a downloadcache.DownloadCache, is supplied the file
+    is taken from or added to the cache. With stream the file is
+    extracted as it downloads and tmp_dir isn't used, unless it's large
+    and the server sends ranges, then it's downloaded in resumable
+    segments, see rangedownload, and extracted afterwards. If it's
+    cancelled its children are killed and dst_path is removed.
     '''
     print('wget_extract: START timeout={} url={} to dst_path={}'.format(timeout, url, dst_path))
     dst_path = os.path.abspath(dst_path)
+    cached_path = None
+    if cache is not None:
+        cached_path = cache.lookup(url, sha256)
+    if cached_path is None and stream and not (cache is not None and cache.offline):
+        info = await rangedownload.probeAsync(url, timeout)
+        if rangedownload.worthSegmenting(info):
+            print('wget_extract: {} is {}MB, downloading it in segments'
+                    .format(url, info.size // (1024 * 1024)))
+            stream = False
+    if cache is not None:
+        if cached_path is None and (cache.offline or not stream):
+            with timing.span('download', url=url) as record:
+                cached_path = await cache.fetchAsync(url, timeout=timeout, sha256=sha256)
+                record['bytes'] += os.path.getsize(cached_path)
+    if cached_path is not None:
+        os.makedirs(dst_path, exist_ok=False)
+        print('wget: extract cached_path={} dst_path={}'.format(cached_path, dst_path))
+        try:
+            await extract_async(cached_path, dst_path, url)
+        except BaseException:
+            shutil.rmtree(dst_path, ignore_errors=True)
+            raise
+        print('wget_extract: DONE timeout={} url={} to dst_path={}'.format(timeout, url, dst_path))
+        return
+    if stream:
+        # The download and extract overlap so they're one span
+        with timing.span('download', url=url, extract=True) as record:
+            await stream_extract_async(url, dst_path, timeout, cache, sha256, record)
+        print_throughput('wget: stream', url, record['bytes'], record)
+        print('wget_extract: DONE timeout={} url={} to dst_path={}'.format(timeout, url, dst_path))
+        return
     tmp_dir = os.path.abspath(tmp_dir)
     os.makedirs(tmp_dir, exist_ok=True)
-    wgetdst_filename = 'wget.tmp'
+    # Named after url so an interrupted download can resume
+    wgetdst_filename = 'wget-{}.tmp'.format(os.path.basename(url.rstrip('/')) or 'index')
     wgetdst_path = os.path.join(tmp_dir, wgetdst_filename)
-    if os.path.exists(wgetdst_path):
-        os.remove(wgetdst_path)
     print('wget: get timeout={} url={} wgetdst_path={}'.format(timeout, url, wgetdst_path))
-    p = subprocess.Popen('wget --timeout={} -qO- {} > {}'.format(timeout, url, wgetdst_path), shell=True)
-    os.waitpid(p.pid, 0)
+    with timing.span('download', url=url) as record:
+        await rangedownload.download(url, wgetdst_path, timeout=timeout, sha256=sha256)
+        record['bytes'] += os.path.getsize(wgetdst_path)
     os.makedirs(dst_path, exist_ok=False)
     print('wget: extract wgetdst_path={} dst_path={}'.format(wgetdst_path, dst_path))
-    subprocess.check_call(['tar', '-xf', wgetdst_path, '--strip-components=1', '-C', dst_path])
+    await extract_async(wgetdst_path, dst_path, url)
     os.remove(wgetdst_path)
     print('wget_extract: DONE timeout={} url={} to dst_path={}'.format(timeout, url, dst_path))
 
-def bash(cmd, stdout=None, stderr=None):
-    if cmd is None:
-        return
-    print('bash: cmd=', cmd)
-
-    subprocess.run(['bash', '-c', cmd],
-            stdout=stdout,
-            stderr=stderr,
-            check=True)
-
-def bashPython2(cmd, stdout=None, stderr=None):
-    bash(('[ ! -d venv2 ] && virtualenv --python=/usr/bin/python2 venv2; ' +
-          'source venv2/bin/activate; ' +
-          '{c}').format(c=cmd),
-         stdout, stderr)
+async def extract_async(archive_path, dst_path, url=None, parallel=True):
+    '''Extracts the tar file archive_path in to dst_path, dropping its top
+    directory, with a parallel decompressor if there's one, see
+    decompress_option_async. The decompression throughput is printed.
+    '''
+    with open(archive_path, 'rb') as f:
+        option, name = await decompress_option_async(f.read(8), parallel)
+    nbytes = os.path.getsize(archive_path)
+    with timing.span('extract', url=url or archive_path, decompressor=name) as record:
+        await run_async(['tar', '-x'] + option + ['-f', archive_path,
+                '--strip-components=1', '-C', dst_path])
+    print_throughput('extract', url or archive_path, nbytes, record)
+
+def wget_extract_all(downloads, workers=4, **kwargs):
+    '''Runs wget_extract concurrently for each (url, dst_path) in downloads.
+
+    At most workers run at once, other keyword arguments are passed to
+    wget_extract. The first failure cancels the downloads still running
+    or waiting, whose partial extractions are removed, and is raised.
+    '''
+    async def extract_all():
+        semaphore = asyncio.Semaphore(workers)
+        async def extract(url, dst_path):
+            async with semaphore:
+                await wget_extract_async(url, dst_path=dst_path, **kwargs)
+        await gather_async([extract(url, dst_path) for url, dst_path in downloads])
+    event_loop().run_until_complete(extract_all())
+
+async def stream_extract_async(url, dst_path, timeout=20, cache=None, sha256=None, record=None):
+    '''Extracts the tar file at url while it downloads.
+
+    wget's output is piped through this process to tar, the format is
+    detected from the first block. If cache is supplied the bytes are
+    also written to a new cache entry, otherwise no copy is kept. The
+    bytes downloaded are added to record, a timing span, if supplied.
+    '''
+    os.makedirs(dst_path, exist_ok=False)
+    print('wget: stream timeout={} url={} dst_path={}'.format(timeout, url, dst_path))
+    part_path = None
+    part = None
+    if cache is not None:
+        part_path = '{}.{}-{}.part'.format(cache.entryPath(url), os.getpid(), id(dst_path))
+        part = open(part_path, 'wb')
+    h = hashlib.sha256()
+    wget = None
+    tar = None
+    try:
+        wget = await start_async(['wget', '--timeout={}'.format(timeout), '-qO-', url],
+                stdout=subprocess.PIPE)
+        # Enough of the start to recognise the compression
+        block = await wget.stdout.read(STREAM_BLOCK_SIZE)
+        while 0 < len(block) < 8:
+            more = await wget.stdout.read(STREAM_BLOCK_SIZE)
+            if not more:
+                break
+            block += more
+        option, name = await decompress_option_async(block)
+        if record is not None:
+            record['decompressor'] = name
+        tar = await start_async(['tar', '-x'] + option +
+                ['--strip-components=1', '-C', dst_path], stdin=subprocess.PIPE)
+        while block:
+            h.update(block)
+            if record is not None:
+                record['bytes'] += len(block)
+            if part is not None:
+                part.write(block)
+            tar.stdin.write(block)
+            await tar.stdin.drain()
+            block = await wget.stdout.read(STREAM_BLOCK_SIZE)
+        tar.stdin.close()
+        await wait_async(wget, 'wget {}'.format(url))
+        await wait_async(tar, 'tar -x {}'.format(url))
+        actual = h.hexdigest()
+        if sha256 is not None and actual != sha256:
+            raise ValueError('wget: {} has sha256 {} expected {}'.format(url, actual, sha256))
+        if part is not None:
+            part.close()
+            cache.add(url, part_path, sha256, actualSha256=actual)
+    except BaseException:
+        for proc in [wget, tar]:
+            if proc is not None and proc.returncode is None:
+                await kill_async(proc)
+        shutil.rmtree(dst_path, ignore_errors=True)
+        raise
+    finally:
+        if part is not None:
+            part.close()
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+def python2_env(venv_dir='venv2'):
+    '''The environment of a python2 virtualenv in venv_dir, created if it
+    doesn't exist, for running commands which need python2 as python'''
+    venv_dir = os.path.abspath(venv_dir)
+    if not os.path.isdir(venv_dir):
+        run(['virtualenv', '--python=/usr/bin/python2', venv_dir])
+    # What sourcing its bin/activate does
+    env = dict(os.environ, VIRTUAL_ENV=venv_dir,
+            PATH=os.pathsep.join([os.path.join(venv_dir, 'bin'), os.environ.get('PATH', '')]))
+    env.pop('PYTHONHOME', None)
+    return env
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 wink saville
+#
+# licensed under the apache license, version 2.0 (the "license");
+# you may not use this file except in compliance with the license.
+# you may obtain a copy of the license at
+#
+#     http://www.apache.org/licenses/license-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the license is distributed on an "as is" basis,
+# without warranties or conditions of any kind, either express or implied.
+# see the license for the specific language governing permissions and
+# limitations under the license.
+
+# Post install verification, used by "install.py verify".
+#
+# Each check names a binary, the directory under the install root it
+# must be installed in, the argument which prints its version and the
+# version expected, taken from the probes in apps and the installer
+# modules. The binaries are found without searching PATH and all of
+# them are probed at once. The version tokens are taken from the first
+# line a binary prints, one must equal the version expected, so 5.3.0
+# doesn't pass for 5.3.0-wink-intr-attr-3 or 15.3.0.
+
+import utils
+import apps
+
+import collections
+import json
+import os
+import re
+import subprocess
+import time
+
+PROBE_TIMEOUT = 10 # Seconds
+
+# A version starts with a number, not in the middle of a word, and has
+# at least one dot, e.g. 2.25.1 in "GNU ld (GNU Binutils) 2.25.1" or
+# 1.22.0 in "crosstool-ng-1.22.0". A git describe suffix, -g<sha>, is
+# also a version, for apps installed from a commit, as is a gdb or
+# binutils development snapshot without its .<date>-git suffix.
+VERSION_RE = re.compile(r'(?<![\w.])\d+(?:\.\d+)+[\w.+~-]*')
+GIT_SHA_RE = re.compile(r'-g([0-9a-f]{7,40})\b')
+SNAPSHOT_RE = re.compile(r'\.\d{8}(?:-\w+)?$')
+
+Check = collections.namedtuple('Check', ['app', 'binary', 'dir', 'versionArg', 'expectedVer'])
+
+def checksFor(names):
+    '''The checks for names, each an app or a binary, in apps.APPS order.
+
+    Only the installer modules of the apps checked are imported for
+    their expected versions. Raises KeyError for a name with no checks.
+    '''
+    probes = [(app.name, probe) for app in apps.APPS for probe in app.probes]
+    for name in names:
+        if not any(name in (app, probe.binary) for app, probe in probes):
+            raise KeyError(name)
+    return [Check(app, probe.binary, probe.dir, probe.versionArg, apps.expectedVer(app, probe))
+            for app, probe in probes if app in names or probe.binary in names]
+
+def versions(line):
+    '''The version tokens in line, the version line a binary printed'''
+    found = [v.rstrip('.-') for v in VERSION_RE.findall(line)]
+    snapshots = [SNAPSHOT_RE.sub('', v) for v in found if SNAPSHOT_RE.search(v)]
+    return found + snapshots + GIT_SHA_RE.findall(line)
+
+def isVersion(expectedVer, found):
+    '''True if one of found, see versions, is expectedVer. An
+    abbreviated git sha matches the longer one it starts.'''
+    for ver in found:
+        if ver == expectedVer:
+            return True
+        if (re.fullmatch('[0-9a-f]{7,40}', ver) and re.fullmatch('[0-9a-f]{7,40}', expectedVer)
+                and (ver.startswith(expectedVer) or expectedVer.startswith(ver))):
+            return True
+    return False
+
+async def probe(check, rootDir, env):
+    '''Run check against the install in rootDir, returns its result as a dict'''
+    path = os.path.join(rootDir, check.dir, check.binary)
+    result = {'app': check.app, 'binary': check.binary, 'path': path,
+            'expectedVer': check.expectedVer, 'actualVer': None, 'ok': False, 'error': None}
+    if not (os.path.isfile(path) and os.access(path, os.X_OK)):
+        result['error'] = 'not installed in {}'.format(os.path.dirname(path))
+        return result
+    try:
+        output = await utils.output_async([path, check.versionArg], timeout=PROBE_TIMEOUT,
+                env=env, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        result['error'] = str(e)
+        return result
+    lines = output.strip().splitlines()
+    result['actualVer'] = lines[0] if lines else ''
+    result['versions'] = versions(result['actualVer'])
+    if isVersion(check.expectedVer, result['versions']):
+        result['ok'] = True
+    else:
+        result['error'] = 'expected version {}, found {}'.format(check.expectedVer,
+                ', '.join(result['versions']) or 'none')
+    return result
+
+def verify(checks, rootDir):
+    '''Probe all the checks concurrently, returns the results in order'''
+    # The install directories go first on PATH, as they are for users
+    dirs = []
+    for c in checks:
+        d = os.path.join(rootDir, c.dir)
+        if d not in dirs:
+            dirs.append(d)
+    env = dict(os.environ, PATH=os.pathsep.join(dirs + [os.environ.get('PATH', '')]))
+    return utils.event_loop().run_until_complete(
+            utils.gather_async([probe(c, rootDir, env) for c in checks]))
+
+def main(args, names):
+    '''Verify names installed with InstallArgs args, returns the exit code.
+
+    A json report of the results is written to <cacheDir>/reports.
+    '''
+    try:
+        checks = checksFor(names)
+    except KeyError as e:
+        print('verify: Unknown app or binary:', e.args[0])
+        return 1
+    startTime = time.monotonic()
+    results = verify(checks, args.installRootDir)
+    elapsed = time.monotonic() - startTime
+
+    for r in results:
+        if r['ok']:
+            print('verify: {} OK ver={} path={}'.format(r['binary'], r['expectedVer'], r['path']))
+        else:
+            print('verify: {} FAILED {}'.format(r['binary'], r['error']))
+            if r['actualVer'] is not None:
+                print('verify:   reported: {}'.format(r['actualVer']))
+    failed = [r['binary'] for r in results if not r['ok']]
+
+    report = {'installRootDir': args.installRootDir, 'ok': len(failed) == 0,
+            'failed': failed, 'seconds': elapsed, 'results': results}
+    reportPath = os.path.join(args.cacheDir, 'reports',
+            time.strftime('verify-%Y%m%d-%H%M%S.json'))
+    os.makedirs(os.path.dirname(reportPath), exist_ok=True)
+    with open(reportPath, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print('verify: {} of {} OK in {:.2f}s, report written to {}'.format(
+            len(results) - len(failed), len(results), elapsed, reportPath))
+    return 0 if len(failed) == 0 else 1